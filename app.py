@@ -1,23 +1,108 @@
-from flask import Flask, request, jsonify  
-from landmark_preprocessor import LandmarkPreprocessor 
-from landmark_meta_generator import LandmarkMetaGenerator
-from geopy.geocoders import Nominatim
-from pymongo import MongoClient
+from flask import Flask, Response, request, jsonify, g
+from landmark_preprocessor import LandmarkPreprocessor, build_landmark_query, incremental_refresh, BBOX_PLACEHOLDER
+from city_resolver import CityResolver
+from mongo_pool import get_client, get_db, close_client
+from city_imports import CityImportLease, get_import_record, is_fresh, record_import
+from meta_jobs import MetaJobQueue
+from spatial_index import NearbyIndex
+from metrics import request_id_var, request_timings_var, render as render_metrics, HTTP_SECONDS
 from dotenv import load_dotenv
 
+import pymongo
+
+import json
 import os
+import time
+import uuid
 
 app = Flask(__name__)
 
 
 load_dotenv(override=True)
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME   = os.getenv("MONGO_DB",  "scavengerhunt")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OVERPASS_TILED = os.getenv("OVERPASS_TILED", "false").lower() == "true"
+CITY_REFRESH_MODE = os.getenv("CITY_REFRESH_MODE", "full").lower()
+
+# 进程内共享: 按 geohash 网格缓存反向地理编码结果
+city_resolver = CityResolver()
+# 城市导入租约和元数据任务保存在 MongoDB, 所有 worker 共享
+city_import_lease = CityImportLease()
+meta_jobs = MetaJobQueue()
+nearby_index = NearbyIndex()
+NEARBY_DEFAULT_RADIUS = float(os.getenv("NEARBY_DEFAULT_RADIUS_M", "500"))
+NEARBY_MAX_RADIUS = float(os.getenv("NEARBY_MAX_RADIUS_M", "5000"))
+NEARBY_MAX_RESULTS = int(os.getenv("NEARBY_MAX_RESULTS", "100"))
+METRICS_RESPONSE_TIMINGS = os.getenv("METRICS_RESPONSE_TIMINGS", "false").lower() == "true"
+HEALTH_MONGO_TIMEOUT = float(os.getenv("HEALTH_MONGO_TIMEOUT", "2"))
+
+def warm_up():
+    """Connect to MongoDB and open the shared clients and caches before the worker starts serving.
+
+    openai and wikipedia stay imported on first use: only metadata generation needs them.
+    """
+    try:
+        with pymongo.timeout(HEALTH_MONGO_TIMEOUT * 5):
+            get_client().admin.command("ping")
+        print(f"[✓] Worker {os.getpid()} connected to MongoDB")
+    except Exception as e:
+        print(f"[!] Worker {os.getpid()} could not reach MongoDB during warm-up: {e}")
+
+    for name, warm in (("city resolver", city_resolver.warmUp), ("metadata jobs / LLM cache", meta_jobs.warmUp)):
+        try:
+            warm()
+        except Exception as e:
+            print(f"[!] Worker {os.getpid()} could not warm up the {name}: {e}")
+
+def drain():
+    """Let queued metadata jobs finish, then release clients."""
+    print(f"[→] Worker {os.getpid()} draining background jobs...")
+    meta_jobs.shutdown(wait=True)
+    close_client()
+
+@app.before_request
+def start_request_metrics():
+    # 请求 ID: 沿用调用方的 X-Request-ID, 否则生成新的
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+    g.timings = []
+    request_id_var.set(g.request_id)
+    request_timings_var.set(g.timings)
+
+@app.after_request
+def finish_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    HTTP_SECONDS.observe(elapsed, endpoint=request.url_rule.rule if request.url_rule else "unmatched",
+                         method=request.method, status=response.status_code)
+    response.headers["X-Request-ID"] = g.request_id
+
+    # ?timings=1 或 METRICS_RESPONSE_TIMINGS=true 时在 JSON 响应中附带各阶段耗时
+    wants_timings = request.args.get("timings", "").lower() in ("1", "true") or METRICS_RESPONSE_TIMINGS
+    if wants_timings and response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["requestId"] = g.request_id
+            body["timings"] = {"totalMs": round(elapsed * 1000, 2), "stages": g.timings}
+            response.set_data(json.dumps(body))
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/live", methods=["GET"])
+def live():
+    # liveness: 进程能处理请求即可, 不检查依赖
+    return jsonify({"status": "ok"}), 200
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"}), 200
+    # readiness: MongoDB 可达
+    try:
+        with pymongo.timeout(HEALTH_MONGO_TIMEOUT):
+            get_client().admin.command("ping")
+    except Exception as e:
+        return jsonify({"status": "unavailable", "mongo": str(e)}), 503
+    return jsonify({"status": "ok", "mongo": "ok"}), 200
 
 @app.route("/resolve-city", methods=["POST"])
 def resolve_city():
@@ -28,20 +113,12 @@ def resolve_city():
     if lat is None or lng is None:
         return jsonify({"status": "error", "message": "Missing latitude/longitude"}), 400
 
-    geolocator = Nominatim(user_agent="scavenger-agent")
     try:
-        location = geolocator.reverse(f"{lat}, {lng}", language='en')
-        if not location:
-            return jsonify({"status": "error", "message": "Could not resolve location"}), 400
-
-        city = location.raw.get("address", {}).get("city") \
-            or location.raw.get("address", {}).get("town") \
-            or location.raw.get("address", {}).get("village")
-
+        city, source = city_resolver.resolve(lat, lng)
         if not city:
             return jsonify({"status": "error", "message": "City not found in location data"}), 400
 
-        print(f"[ResolveCity] Resolved: {city}")
+        print(f"[ResolveCity] Resolved: {city} ({source})")
         return jsonify({"status": "ok", "city": city})
 
     except Exception as e:
@@ -56,51 +133,33 @@ def fetch_landmark():
     if lat is None or lng is None:
         return jsonify({"status": "error", "message": "Missing lat/lng"}), 400
 
-    # use internal resolve_city() function instead of duplicating logic
-    with app.test_request_context('/resolve-city', method='POST', json={"latitude": lat, "longitude": lng}):
-        resolve_response = resolve_city().get_json()
-    
-    if resolve_response["status"] != "ok":
+    try:
+        city, source = city_resolver.resolve(lat, lng)
+    except Exception as e:
+        print(f"[ResolveCity] Error: {e}")
+        city = None
+
+    if not city:
         return jsonify({"status": "error", "message": "Failed to resolve city"}), 400
-    
-    city = resolve_response["city"]
-    print(f"[Landmark Processor] Resolved city: {city}")
 
-    # check MongoDB
-    client = MongoClient(MONGO_URL)
-    db = client[DB_NAME]
-    collection = db["landmarks"]
+    print(f"[Landmark Processor] Resolved city: {city} ({source})")
 
-    existing_count = collection.count_documents({"city": city})
-    print(f"[Landmark Processor] Found {existing_count} landmarks for city {city} in DB")
+    # 导入记录在有效期内则直接返回, 不再请求 Overpass
+    record = get_import_record(city)
+    if is_fresh(record):
+        print(f"[✓] Landmark data for {city} already initialized ({record.get('elementCount')} landmarks), skipping fetch.")
+        return jsonify({"status": "ok", "city": city})
 
-    # if existing_count > 20:
-    #     print(f"[✓] Landmark data for {city} already initialized, skipping fetch.")
-    #     return jsonify({"status": "ok", "city": city})
-    
-    print(f"[!] Landmark data for {city} appears incomplete ({existing_count}), proceeding with fetch...")
-
-    query = f"""
-    [out:json];
-    area["name"="{city}"]["boundary"="administrative"]->.searchArea;
-
-    (
-        way["amenity"]["name"]["amenity"!="parking"]["amenity"!="parking_space"]["amenity"!="bicycle_parking"]["amenity"!="waste_disposal"](area.searchArea);
-        way["tourism"]["name"]["tourism"!="guest_house"](area.searchArea);
-        way["historic"]["name"](area.searchArea);
-        way["leisure"]["name"]["leisure"!="pitch"](area.searchArea);
-        way["building"]["name"](area.searchArea);
-    );
-    out geom;
-    """
+    print(f"[!] Landmark data for {city} is missing or stale, proceeding with fetch...")
 
     try:
-        LandmarkPreprocessor(query, city=city)\
-            .fetchRaw()\
-            .findRawLandmarks()\
-            .processRawLandmark()\
-            .storeToDB(overwrite=False, mongo_url=MONGO_URL)
-            # .removeDuplicates()
+        # 同一城市的并发请求 (包括其他 worker 的) 共享同一次导入
+        count, shared = city_import_lease.do(city, lambda: refresh_city(city))
+        if shared:
+            print(f"[Landmark Processor] Joined in-flight import for {city}")
+        else:
+            # 城市数据已更新, 下次查询时重建附近地标索引
+            nearby_index.invalidate(city)
 
         return jsonify({"status": "ok", "city": city})
     
@@ -108,6 +167,87 @@ def fetch_landmark():
         print(f"[Landmark Processor] Landmark processing failed: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/landmarks/nearby", methods=["POST"])
+def landmarks_nearby():
+    data = request.get_json(force=True) or {}
+    lat = data.get("latitude")
+    lng = data.get("longitude")
+    if lat is None or lng is None:
+        return jsonify({"status": "error", "message": "Missing latitude/longitude"}), 400
+
+    tags = data.get("tags") or None
+    if tags is not None and not isinstance(tags, dict):
+        return jsonify({"status": "error", "message": "tags must be an object"}), 400
+
+    try:
+        lat, lng = float(lat), float(lng)
+        k = int(data["k"]) if data.get("k") is not None else None
+        radius = float(data.get("radius") or NEARBY_DEFAULT_RADIUS)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid latitude/longitude/radius/k"}), 400
+    if (k is not None and k <= 0) or radius <= 0:
+        return jsonify({"status": "error", "message": "radius and k must be positive"}), 400
+    radius = min(radius, NEARBY_MAX_RADIUS)
+
+    try:
+        city = data.get("city")
+        if not city:
+            city, _ = city_resolver.resolve(lat, lng)
+        if not city:
+            return jsonify({"status": "error", "message": "Failed to resolve city"}), 400
+
+        index = nearby_index.get(city)
+        # k: 最近的 k 个 (不超过 NEARBY_MAX_RADIUS_M); 否则返回 radius 米内的全部地标
+        if k is not None:
+            found = index.nearest(lat, lng, min(k, NEARBY_MAX_RESULTS), tags=tags, max_radius=NEARBY_MAX_RADIUS)
+        else:
+            found = index.withinRadius(lat, lng, radius, tags=tags)[:NEARBY_MAX_RESULTS]
+
+        return jsonify({
+            "status": "ok",
+            "city": city,
+            "landmarks": [dict(landmark, distance=round(distance, 1)) for distance, landmark in found]
+        })
+    except Exception as e:
+        print(f"[Nearby] Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def refresh_city(city):
+    # 等待期间可能已有其他请求完成了导入, 再检查一次
+    record = get_import_record(city)
+    if is_fresh(record):
+        return record.get("elementCount", 0)
+    # CITY_REFRESH_MODE=incremental: 已导入过的城市只拉取上次导入之后变更的要素
+    if record and record.get("importedAt") and CITY_REFRESH_MODE == "incremental":
+        delta = incremental_refresh(city, record["importedAt"])
+        count = get_db()["landmarks"].count_documents({"city": city, "deleted": {"$ne": True}})
+        record_import(city, count, mode="incremental", changed=delta["changed"], deleted=delta["deleted"])
+        return count
+    return import_city(city)
+
+def import_city(city):
+    # OVERPASS_TILED=true: 大城市按边界框分块并行抓取, 避免单个查询超时
+    bbox = city_resolver.cityBoundingBox(city) if OVERPASS_TILED else None
+
+    if bbox:
+        processor = LandmarkPreprocessor(build_landmark_query(city, bbox=BBOX_PLACEHOLDER, timeout=180), city=city, source="area")\
+            .fetchTiled(bbox)
+    else:
+        processor = LandmarkPreprocessor(build_landmark_query(city), city=city, source="area")\
+            .fetchRaw(stream=True)
+
+    processor.findRawLandmarks()\
+        .processRawLandmark()
+
+    count = len(processor.processedLandmarks)
+    # 空结果不记录导入, 否则该城市在 CITY_IMPORT_MAX_AGE_HOURS 内都会被跳过
+    if not count:
+        print(f"[!] No landmarks found for {city}; not marking it as imported.")
+        return 0
+    processor.storeToDB(overwrite=False)
+    record_import(city, count, mode="full")
+    return count
+
 @app.route("/generate-landmark-meta", methods=["POST"])
 def generate_landmark_meta():
     
@@ -118,8 +258,7 @@ def generate_landmark_meta():
     if not landmark_ids or not isinstance(landmark_ids, list):
         return jsonify({"status": "error", "message": "landmarkIds must be a non-empty list"}), 400
     
-    client = MongoClient(MONGO_URL)
-    db = client[DB_NAME]
+    db = get_db()
 
     if not override:
         existing_ids = db["landmark_metadata"].find(
@@ -136,9 +275,21 @@ def generate_landmark_meta():
             "skipped": "all exist" if not override else 0,
             "failed": 0
         })
+
+    # async=true: 立即返回 jobId, 后台生成, 通过 /generate-landmark-meta/<jobId> 查询进度
+    if data.get("async"):
+        job, merged = meta_jobs.submit(landmark_ids)
+        return jsonify({
+            "status": "accepted",
+            "jobId": job["jobId"] if job else None,
+            "queued": job["total"] if job else 0,
+            "merged": merged
+        }), 202
     
     try:
-        generator = LandmarkMetaGenerator("openai") 
+        # 元数据生成依赖 openai / wikipedia, 第一次请求时才导入
+        from landmark_meta_generator import LandmarkMetaGenerator
+        generator = LandmarkMetaGenerator("openai", llm_cache=meta_jobs.llmCache())
         generator.loadLandmarksFromDB(landmark_ids).fetchWiki().fetchOpenAI().storeToDB(collection_name="landmark_metadata", overwrite=False)
         
         return jsonify({
@@ -151,6 +302,13 @@ def generate_landmark_meta():
         print(f"[Meta Generator] Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/generate-landmark-meta/<job_id>", methods=["GET"])
+def generate_landmark_meta_status(job_id):
+    job = meta_jobs.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify({"status": "ok", "job": job})
+
 
 if __name__ == "__main__":
     # app.run(port=5000)
@@ -158,5 +316,7 @@ if __name__ == "__main__":
     port = int(os.getenv('FLASK_PORT', '5000'))  # 默认值
     debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'  # 默认值
     
+    # 开发服务器; 生产环境使用 gunicorn -c gunicorn.conf.py app:app
+    warm_up()
     app.run(host=host, port=port, debug=debug)
     
\ No newline at end of file
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Seed many cities: fetch -> extract -> process -> store, across a process pool.
+
+    python batch_ingest.py --cities Cork Galway Limerick
+    python batch_ingest.py cities.txt --workers 4 --overpass-slots 2
+
+cities.txt has one city per line, either a plain name (its administrative
+area is queried) or a JSON object with a bbox or polygon:
+
+    Cork
+    {"city": "Kinsale", "bbox": [51.69, -8.54, 51.72, -8.50]}
+    {"city": "Cobh", "poly": [[51.84, -8.31], [51.86, -8.31], [51.86, -8.27]]}
+
+Every stage of every city is checkpointed under --checkpoint-dir; a rerun
+skips cities that finished and resumes the others after their last
+completed stage (a fetched Overpass payload is not fetched again).
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from landmark_preprocessor import LandmarkPreprocessor, build_landmark_query
+from city_imports import record_import
+
+load_dotenv()
+
+DEFAULT_CHECKPOINT_DIR = os.path.join("outputfiles", "batch_ingest")
+
+# 所有工作进程共享的 Overpass 并发槽位
+_overpass_slots = None
+
+
+def load_tasks(path=None, cities=None):
+    tasks = [{"city": city} for city in cities or []]
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                tasks.append(json.loads(line) if line.startswith("{") else {"city": line})
+    for task in tasks:
+        if not task.get("city"):
+            raise ValueError(f"Task without a city: {task}")
+    return tasks
+
+
+def task_id(task):
+    # 同名城市不同范围视为不同任务
+    digest = hashlib.sha1(json.dumps(task, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return f"{re.sub(r'[^0-9A-Za-z]+', '_', task['city']).strip('_') or 'city'}-{digest}"
+
+
+def task_source(task):
+    # 整个行政区的导入才是 "area", 增量刷新只清理这类地标
+    return "poly" if task.get("poly") else "bbox" if task.get("bbox") else "area"
+
+
+class Checkpoint:
+    """Per-task stage state in <checkpoint_dir>/<task_id>/state.json, written atomically."""
+
+    def __init__(self, checkpoint_dir, task):
+        self.dir = os.path.join(checkpoint_dir, task_id(task))
+        self.path = os.path.join(self.dir, "state.json")
+        self.rawPath = os.path.join(self.dir, "raw.json.gz")
+        os.makedirs(self.dir, exist_ok=True)
+        self.state = {"task": task, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def done(self, stage):
+        return self.state["stages"].get(stage, {}).get("status") == "done"
+
+    def mark(self, stage, status, **fields):
+        self.state["stages"][stage] = {"status": status, "at": datetime.now(timezone.utc).isoformat(), **fields}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _initWorker(slots):
+    global _overpass_slots
+    _overpass_slots = slots
+
+
+def ingest_city(task, checkpoint_dir, overwrite=False, retries=3, timeout=180, keep_raw=False):
+    """Run the remaining stages for one task; returns a summary dict."""
+    city = task["city"]
+    checkpoint = Checkpoint(checkpoint_dir, task)
+    if checkpoint.done("store"):
+        return {"city": city, "status": "skipped", "landmarks": checkpoint.state["stages"]["store"].get("landmarks")}
+
+    stage = "fetch"
+    try:
+        query = build_landmark_query(
+            None if task.get("bbox") or task.get("poly") else city,
+            bbox=task.get("bbox"), poly=task.get("poly"), timeout=timeout
+        )
+        if not (checkpoint.done("fetch") and os.path.exists(checkpoint.rawPath)):
+            start = time.time()
+            elements = _fetchWithRetries(query, city, retries, checkpoint.rawPath)
+            checkpoint.mark("fetch", "done", elements=elements, bytes=os.path.getsize(checkpoint.rawPath),
+                            seconds=round(time.time() - start, 2))
+
+        stage = "process"
+        start = time.time()
+        # 从检查点逐个解析 elements, 不把整个响应读入内存
+        processor = LandmarkPreprocessor.fromSnapshot(checkpoint.rawPath, city=city, query=query, source=task_source(task))
+        processor.findRawLandmarks().processRawLandmark()
+        count = len(processor.processedLandmarks)
+        checkpoint.mark("process", "done", landmarks=count, seconds=round(time.time() - start, 2))
+
+        stage = "store"
+        start = time.time()
+        if count:
+            processor.storeToDB(overwrite=overwrite)
+        # 只有完整行政区的导入才标记城市为最新; 局部范围或空结果让 /fetch-landmark 继续导入
+        if task_source(task) == "area" and count:
+            record_import(city, count, mode="batch")
+        checkpoint.mark("store", "done", landmarks=count, seconds=round(time.time() - start, 2))
+        if not keep_raw:
+            os.remove(checkpoint.rawPath)
+        return {"city": city, "status": "done", "landmarks": count}
+
+    except Exception as e:
+        checkpoint.mark(stage, "failed", error=str(e))
+        return {"city": city, "status": "failed", "stage": stage, "error": str(e)}
+
+
+def _fetchWithRetries(query, city, retries, path):
+    """Stream the Overpass response into ``path``; returns its element count."""
+    for attempt in range(retries + 1):
+        # 只有拿到槽位才请求 Overpass, 其余工作进程继续处理已下载的城市
+        if _overpass_slots is not None:
+            _overpass_slots.acquire()
+        try:
+            # 原始数据流式写入检查点, 不再重复写 Overpass 缓存; 逐个解析 elements 校验完整性 (含 remark)
+            processor = LandmarkPreprocessor(query, city=city).fetchRaw(stream=True, use_cache=False, snapshot=path)
+            return sum(1 for _ in processor.rawStream)
+        except Exception as e:
+            if attempt == retries:
+                raise RuntimeError(f"Overpass fetch failed after {retries + 1} attempts: {e}") from e
+            delay = min(300, 15 * 2 ** attempt)
+            print(f"[!] {city}: fetch attempt {attempt + 1} failed ({str(e)[:120]}), retrying in {delay}s")
+        finally:
+            if _overpass_slots is not None:
+                _overpass_slots.release()
+        time.sleep(delay)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-import landmarks for many cities with resumable checkpoints.")
+    parser.add_argument("file", nargs="?", help="Cities file: one name or JSON object per line")
+    parser.add_argument("--cities", nargs="+", help="City names")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_INGEST_WORKERS", str(os.cpu_count() or 2))))
+    parser.add_argument("--overpass-slots", type=int, default=int(os.getenv("OVERPASS_MAX_CONCURRENT", "2")),
+                        help="Concurrent Overpass requests across all workers")
+    parser.add_argument("--checkpoint-dir", default=os.getenv("BATCH_INGEST_CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR))
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=int, default=180, help="Overpass query timeout in seconds")
+    parser.add_argument("--overwrite", action="store_true", help="Update geometry/tags of existing landmarks")
+    parser.add_argument("--keep-raw", action="store_true", help="Keep fetched Overpass payloads after storing")
+    parser.add_argument("--force", action="store_true", help="Ignore checkpoints and redo every city")
+    args = parser.parse_args(argv)
+
+    tasks = load_tasks(args.file, args.cities)
+    if not tasks:
+        parser.error("no cities given")
+    if args.force:
+        for task in tasks:
+            checkpoint = Checkpoint(args.checkpoint_dir, task)
+            if os.path.exists(checkpoint.path):
+                os.remove(checkpoint.path)
+
+    print(f"[*] Ingesting {len(tasks)} cities with {args.workers} workers, {args.overpass_slots} Overpass slots")
+    slots = multiprocessing.get_context().BoundedSemaphore(args.overpass_slots)
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_initWorker, initargs=(slots,)) as executor:
+        futures = {
+            executor.submit(ingest_city, task, args.checkpoint_dir, args.overwrite, args.retries, args.timeout, args.keep_raw): task
+            for task in tasks
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "failed":
+                print(f"[x] {result['city']}: {result['stage']} failed: {result['error']}")
+            elif result["status"] == "skipped":
+                print(f"[→] {result['city']}: already done ({result['landmarks']} landmarks)")
+            else:
+                print(f"[✓] {result['city']}: {result['landmarks']} landmarks")
+
+    counts = {status: sum(r["status"] == status for r in results) for status in ("done", "skipped", "failed")}
+    print(f"\n[Summary] {counts['done']} imported, {counts['skipped']} already done, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
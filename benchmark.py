@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark with synthetic Overpass payloads and local stand-ins for
+MongoDB, OpenAI and Wikipedia.
+
+    python benchmark.py --sizes 1000 10000 100000 --repeat 5
+    python benchmark.py --save-baseline            # record current numbers
+    python benchmark.py                            # fail on regression vs baseline
+    python benchmark.py --snapshots outputfiles/cork_raw.json.gz   # also replay a saved city
+
+Each stage runs ``--repeat`` times per payload size. Reported per stage:
+throughput (items/s at the median run), p50/p99 run time and peak RSS.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import wikipedia
+
+import mongo_pool
+import landmark_meta_generator as lmg
+from landmark_preprocessor import LandmarkPreprocessor
+from landmark_meta_generator import LandmarkMetaGenerator
+from overpass_stream import iter_elements, CHUNK_SIZE
+from llm_cache import LLMCache
+from rate_limit import TokenBucket
+
+DEFAULT_BASELINE = os.path.join("outputfiles", "benchmark_baseline.json")
+
+# 与 LANDMARK_FILTERS 对应的标签
+TAG_CHOICES = [
+    ("amenity", ["place_of_worship", "school", "library", "theatre", "cafe"]),
+    ("tourism", ["museum", "attraction", "artwork", "hotel"]),
+    ("historic", ["castle", "monument", "memorial", "ruins"]),
+    ("leisure", ["park", "garden", "stadium"]),
+    ("building", ["yes", "church", "university", "civic"]),
+]
+NAME_WORDS = ["Saint", "Old", "North", "Market", "Abbey", "Bridge", "Castle", "Park", "Hall",
+              "Tower", "Church", "Gate", "Garden", "House", "Museum", "Square", "Mill", "Quay"]
+
+
+# ---------- synthetic input ----------
+
+def synthetic_payload(ways, seed=42, duplicate_rate=0.1, center=(51.8985, -8.4756)):
+    """Overpass ``out geom meta`` JSON for ``ways`` closed ways around ``center``.
+
+    Vertex counts are log-normal (mostly 5-20, a long tail of large parks),
+    and about ``duplicate_rate`` of the ways reuse an earlier name.
+    """
+    rng = random.Random(seed)
+    names = []
+    parts = ['{"version":0.6,"generator":"benchmark","elements":[']
+    spread = 0.02 * math.sqrt(max(ways, 1) / 1000)
+    for i in range(ways):
+        if names and rng.random() < duplicate_rate:
+            name = rng.choice(names)
+        else:
+            name = f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {i}"
+            names.append(name)
+        key, values = rng.choice(TAG_CHOICES)
+        vertices = min(2000, max(4, int(rng.lognormvariate(2.2, 0.8))))
+        lat = center[0] + rng.uniform(-spread, spread)
+        lon = center[1] + rng.uniform(-spread, spread) / 0.62
+        radius = 0.0001 * (1 + vertices / 50)
+        ring = [{"lat": round(lat + radius * math.sin(2 * math.pi * k / vertices), 7),
+                 "lon": round(lon + radius * math.cos(2 * math.pi * k / vertices) / 0.62, 7)}
+                for k in range(vertices)]
+        ring.append(ring[0])
+        element = {
+            "type": "way",
+            "id": 100000000 + i,
+            "version": rng.randint(1, 9),
+            "timestamp": "2025-01-01T00:00:00Z",
+            "geometry": ring,
+            "tags": {"name": name, key: rng.choice(values)},
+        }
+        parts.append(("," if i else "") + json.dumps(element, separators=(",", ":")))
+    parts.append("]}")
+    return "".join(parts)
+
+
+# ---------- stand-ins ----------
+
+class FakeCollection:
+    """Just enough of a pymongo collection for the pipelines' write paths."""
+
+    def __init__(self):
+        self.docs = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        return "benchmark_index"
+
+    def bulk_write(self, operations, ordered=True):
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0}
+        with self._lock:
+            for op in operations:
+                key = json.dumps(op._filter, sort_keys=True, default=str)
+                if key in self.docs:
+                    result["nMatched"] += 1
+                    if "$set" in op._doc:
+                        self.docs[key].update(op._doc["$set"])
+                        result["nModified"] += 1
+                else:
+                    self.docs[key] = dict(op._doc.get("$setOnInsert", {}), **op._doc.get("$set", {}))
+                    result["nUpserted"] += 1
+        return SimpleNamespace(bulk_api_result=result)
+
+    def find(self, query=None, projection=None):
+        return iter(list(self.docs.values()))
+
+    def count_documents(self, query):
+        return len(self.docs)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class FakeMongoClient(dict):
+    def __missing__(self, name):
+        db = self[name] = FakeDatabase()
+        return db
+
+    def close(self):
+        pass
+
+
+class FakeWikiPage:
+    def __init__(self, title):
+        self.title = title
+        self.url = "https://en.wikipedia.org/wiki/" + title.replace(" ", "_")
+        self.summary = f"{title} is a landmark. " * 20
+        self.content = f"{title} has a long history. " * 400
+        self.images = [f"{self.url}/image_{i}.jpg" for i in range(8)] + [f"{self.url}/icon.svg"]
+
+
+class FakeWikipedia:
+    """wikipedia.page() with fixed latency; ~10% of titles are missing."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.exceptions = wikipedia.exceptions
+
+    def page(self, title, auto_suggest=True):
+        time.sleep(self.latency)
+        if zlib.crc32(title.encode("utf-8")) % 10 == 0:
+            raise self.exceptions.PageError(title)
+        return FakeWikiPage(title)
+
+
+class FakeOpenAI:
+    """OpenAI client whose chat completions answer the generator's prompts
+    (single and batched verification/summarization) after a fixed latency."""
+
+    latency = 0.05
+
+    def __init__(self, api_key=None):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, **params):
+        time.sleep(self.latency)
+        content = messages[-1]["content"]
+        texts = [content] if isinstance(content, str) else [part["text"] for part in content if part["type"] == "text"]
+        prompt = "\n".join(texts)
+
+        summary = {"history": ["founded", "restored"], "architecture": ["stone", "gothic"], "significance": ["civic"]}
+        if model == "gpt-4":
+            count = len(re.findall(r"^\s*\d+\. Target Landmark", prompt, re.M))
+            reply = json.dumps([{"id": i, "match": True} for i in range(1, count + 1)]) if count else "true"
+        else:
+            count = len(re.findall(r"^Landmark \d+:", prompt, re.M))
+            reply = json.dumps([dict(summary, id=i) for i in range(1, count + 1)]) if count else json.dumps(summary)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+def install_stand_ins(mongo_url=None, wiki_latency=0.01, openai_latency=0.05):
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+        mongo_pool.close_client()
+    else:
+        mongo_pool._client = FakeMongoClient()
+    fake_wikipedia = FakeWikipedia(wiki_latency)
+    lmg._wikipedia_module = lambda: fake_wikipedia
+    FakeOpenAI.latency = openai_latency
+    lmg._openai_client = lambda api_key: FakeOpenAI(api_key)
+    # 基准测试只测本地开销, 不限流
+    lmg.WIKI_BUCKET = TokenBucket(0)
+    lmg.OPENAI_BUCKET = TokenBucket(0)
+
+
+# ---------- measurement ----------
+
+class RSSSampler:
+    """Peak resident set size (MB) while the block runs, sampled from /proc."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # 非 Linux: 只能拿到进程历史峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def measure(stage, size, repeat, setup, run, items):
+    """Run ``setup() -> state`` then the timed ``run(state)`` ``repeat`` times."""
+    times = []
+    peak = 0.0
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        with RSSSampler() as rss:
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+        peak = max(peak, rss.peak)
+        del state
+    p50 = percentile(times, 50)
+    result = {
+        "stage": stage,
+        "size": size,
+        "items": items,
+        "throughput": items / p50 if p50 else float("inf"),
+        "p50": p50,
+        "p99": percentile(times, 99),
+        "peakRssMB": peak,
+    }
+    print(f"[✓] {stage:<28} n={size:<8} {result['throughput']:>12.0f}/s  "
+          f"p50 {p50 * 1000:>9.1f}ms  p99 {result['p99'] * 1000:>9.1f}ms  peak RSS {peak:>8.1f}MB")
+    return result
+
+
+# ---------- stages ----------
+
+def preprocessor_stages(size, repeat, seed):
+    payload = synthetic_payload(size, seed)
+    print(f"[→] Payload with {size} ways: {len(payload) / 2 ** 20:.1f}MB")
+    results = []
+
+    def parsed():
+        p = LandmarkPreprocessor("benchmark", city="Benchcity")
+        p.db_name = "benchmark"
+        p.rawData = payload
+        return p
+
+    def found():
+        return parsed().findRawLandmarks()
+
+    def processed():
+        return found().processRawLandmark()
+
+    def streamed():
+        p = parsed()
+        p.rawData = None
+        chunks = (payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE))
+        p.rawStream = iter_elements(chunks)
+        return p
+
+    processed_count = len(processed().processedLandmarks)
+    results.append(measure("findRawLandmarks", size, repeat, parsed, lambda p: p.findRawLandmarks(), size))
+    results.append(measure("processRawLandmark", size, repeat, found, lambda p: p.processRawLandmark(), processed_count))
+    results.append(measure("stream+process", size, repeat, streamed,
+                           lambda p: p.findRawLandmarks().processRawLandmark(), processed_count))
+    results.append(measure("storeToDB", size, repeat, processed, lambda p: p.storeToDB(), processed_count))
+    return results
+
+
+def snapshot_stages(path, repeat):
+    # 固定输入: 回放已保存的原始快照 (saveRawOSMAsFile / batch_ingest 的 raw.json.gz)
+    def replayed():
+        return LandmarkPreprocessor.fromSnapshot(path, city="Benchcity")
+
+    processed_count = len(replayed().findRawLandmarks().processRawLandmark().processedLandmarks)
+    name = os.path.basename(path)
+    print(f"[→] Snapshot {name}: {os.path.getsize(path) / 2 ** 20:.1f}MB on disk")
+    return [measure(f"snapshot:{name}", processed_count, repeat, replayed,
+                    lambda p: p.findRawLandmarks().processRawLandmark(), processed_count)]
+
+
+def meta_stages(count, repeat, batch_size, workers):
+    cache_dir = tempfile.mkdtemp(prefix="benchmark_llm_")
+    landmarks = [(f"{i:024x}", f"{NAME_WORDS[i % len(NAME_WORDS)]} Landmark {i}", "Benchcity") for i in range(count)]
+    results = []
+
+    def generator():
+        g = LandmarkMetaGenerator("openai", llm_cache=LLMCache(os.path.join(cache_dir, "llm.sqlite3")), bypass_cache=True)
+        g.db_name = "benchmark"
+        g.landmarks = list(landmarks)
+        return g
+
+    def wikied():
+        return generator().fetchWiki(workers=workers, batch_size=batch_size)
+
+    def summarized():
+        return wikied().fetchOpenAI(workers=workers, batch_size=batch_size)
+
+    results.append(measure("meta.fetchWiki", count, repeat, generator,
+                           lambda g: g.fetchWiki(workers=workers, batch_size=batch_size), count))
+    results.append(measure("meta.fetchOpenAI", count, repeat, wikied,
+                           lambda g: g.fetchOpenAI(workers=workers, batch_size=batch_size), count))
+    results.append(measure("meta.storeToDB", count, repeat, summarized, lambda g: g.storeToDB(overwrite=True), count))
+    return results
+
+
+# ---------- baseline ----------
+
+def compare(results, baseline, tolerance):
+    """Regressions: throughput below or peak RSS above baseline by more than ``tolerance``."""
+    reference = {(r["stage"], r["size"]): r for r in baseline.get("results", [])}
+    failures = []
+    for r in results:
+        base = reference.get((r["stage"], r["size"]))
+        if base is None:
+            continue
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            failures.append(f"{r['stage']} n={r['size']}: throughput {r['throughput']:.0f}/s < baseline {base['throughput']:.0f}/s")
+        if r["peakRssMB"] > base["peakRssMB"] * (1 + tolerance):
+            failures.append(f"{r['stage']} n={r['size']}: peak RSS {r['peakRssMB']:.1f}MB > baseline {base['peakRssMB']:.1f}MB")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage with synthetic payloads.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Synthetic payload sizes in ways (up to 1000000)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--snapshots", nargs="+", default=[],
+                        help="Saved raw Overpass snapshots to replay through find+process (fixed inputs)")
+    parser.add_argument("--meta-landmarks", type=int, default=200, help="Landmarks for the metadata stages; 0 skips them")
+    parser.add_argument("--meta-batch-size", type=int, default=None)
+    parser.add_argument("--meta-workers", type=int, default=None)
+    parser.add_argument("--wiki-latency", type=float, default=0.01, help="Seconds per fake Wikipedia call")
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="Seconds per fake OpenAI call")
+    parser.add_argument("--mongo-url", help="Use a local MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs baseline (fraction)")
+    parser.add_argument("--output", help="Also write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    install_stand_ins(args.mongo_url, args.wiki_latency, args.openai_latency)
+
+    results = []
+    for size in args.sizes:
+        results += preprocessor_stages(size, args.repeat, args.seed)
+        gc.collect()
+    for path in args.snapshots:
+        results += snapshot_stages(path, args.repeat)
+        gc.collect()
+    if args.meta_landmarks:
+        results += meta_stages(args.meta_landmarks, args.repeat, args.meta_batch_size, args.meta_workers)
+
+    report = {"createdAt": time.time(), "python": sys.version.split()[0], "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[✓] Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[!] No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        failures = compare(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print(f"[x] Regression: {failure}")
+    if not failures:
+        print(f"[✓] No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import os
+
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", "1000"))
+DUPLICATE_KEY_ERROR = 11000
+
+
+def bulk_upsert(collection, operations, batch_size=BULK_BATCH_SIZE):
+    """Send write operations as unordered ``bulk_write`` batches.
+
+    Returns one dict per batch with inserted/updated/skipped/failed counts.
+    Duplicate-key errors on upserts (a guarded filter that did not match an
+    existing document) count as skipped. ``skippedOps`` / ``failedOps`` list
+    the positions in ``operations`` of those write errors.
+    """
+    results = []
+    batch = []
+    offset = 0
+    for op in operations:
+        batch.append(op)
+        if len(batch) >= batch_size:
+            results.append(_writeBatch(collection, batch, len(results), offset))
+            offset += len(batch)
+            batch = []
+    if batch:
+        results.append(_writeBatch(collection, batch, len(results), offset))
+    return results
+
+
+def _writeBatch(collection, batch, index, offset=0):
+    counts = {"batch": index, "size": len(batch), "inserted": 0, "updated": 0, "skipped": 0, "failed": 0,
+              "skippedOps": [], "failedOps": []}
+    try:
+        details = collection.bulk_write(batch, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for err in details.get("writeErrors", []):
+            if err.get("code") == DUPLICATE_KEY_ERROR:
+                counts["skipped"] += 1
+                counts["skippedOps"].append(offset + err.get("index", 0))
+            else:
+                counts["failed"] += 1
+                counts["failedOps"].append(offset + err.get("index", 0))
+                print(f"[x] Bulk write error (op {err.get('index')}): {err.get('errmsg')}")
+
+    counts["inserted"] = details.get("nUpserted", 0) + details.get("nInserted", 0)
+    counts["updated"] = details.get("nModified", 0)
+    # 匹配到但未修改 (例如 $setOnInsert 命中已有文档) 视为跳过
+    counts["skipped"] += details.get("nMatched", 0) - details.get("nModified", 0)
+    return counts
+
+
+def summarize(batches):
+    total = {"batches": len(batches), "inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+    for counts in batches:
+        for field in ("inserted", "updated", "skipped", "failed"):
+            total[field] += counts[field]
+    return total
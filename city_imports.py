@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from mongo_pool import get_db
+
+load_dotenv()
+
+IMPORTS_COLLECTION = "city_imports"
+LEASE_SECONDS = float(os.getenv("CITY_IMPORT_LEASE_SECONDS", "120"))
+LEASE_POLL_SECONDS = float(os.getenv("CITY_IMPORT_LEASE_POLL_SECONDS", "1"))
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers for the
+    same key wait for it and share its result (or exception)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CityImportLease:
+    """SingleFlight across worker processes: the city's ``city_imports``
+    document carries a lease, taken with ``findOneAndUpdate``.
+
+    The worker holding the lease runs the import and renews the lease every
+    ``ttl / 3`` seconds; when it finishes it stores the result (or error) in
+    ``lastLease``. Other workers poll until that result appears and share it.
+    A lease that is not renewed (the worker died) expires after ``ttl``
+    seconds and the next waiter takes over. Threads of one process are
+    coalesced in memory first, so only one of them polls MongoDB.
+    """
+
+    def __init__(self, ttl=None, poll=None):
+        self.ttl = ttl or LEASE_SECONDS
+        self.poll = poll or LEASE_POLL_SECONDS
+        self._flight = SingleFlight()
+
+    def do(self, city, fn):
+        (result, shared_remote), shared_local = self._flight.do(city, lambda: self._leased(city, fn))
+        return result, shared_remote or shared_local
+
+    def _leased(self, city, fn):
+        collection = imports_collection()
+        waiting_for = None
+        while True:
+            owner = uuid.uuid4().hex
+            doc = self._acquire(collection, city, owner)
+            if doc is None:
+                lease = (collection.find_one({"city": city}, {"lease": 1}) or {}).get("lease")
+                if lease:
+                    waiting_for = lease["owner"]
+                time.sleep(self.poll)
+                continue
+
+            last = doc.get("lastLease") or {}
+            if waiting_for is None or last.get("owner") != waiting_for:
+                return self._run(collection, city, owner, fn), False
+            # 等待的导入已经结束: 交还租约, 共享它的结果
+            collection.update_one({"city": city, "lease.owner": owner}, {"$set": {"lease": None}})
+            if last.get("error"):
+                raise RuntimeError(f"Import of {city} failed in another worker: {last['error']}")
+            return last.get("result"), True
+
+    def _acquire(self, collection, city, owner):
+        now = datetime.now(timezone.utc)
+        try:
+            # 没有租约或租约已过期才能取得; 文档不存在时 upsert 创建
+            doc = collection.find_one_and_update(
+                {"city": city, "$or": [{"lease": None}, {"lease.until": {"$lt": now}}]},
+                {"$set": {"lease": {"owner": owner, "until": now + timedelta(seconds=self.ttl)}}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # 文档存在且租约有效: city 唯一索引拒绝 upsert
+            return None
+        return doc if doc is not None and doc["lease"]["owner"] == owner else None
+
+    def _run(self, collection, city, owner, fn):
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(collection, city, owner, stop), daemon=True)
+        renewer.start()
+        last = {"owner": owner, "result": None, "error": None}
+        try:
+            last["result"] = fn()
+            return last["result"]
+        except BaseException as e:
+            last["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            stop.set()
+            renewer.join()
+            last["finishedAt"] = datetime.now(timezone.utc)
+            collection.update_one(
+                {"city": city, "lease.owner": owner},
+                {"$set": {"lease": None, "lastLease": last}}
+            )
+
+    def _renew(self, collection, city, owner, stop):
+        while not stop.wait(self.ttl / 3):
+            until = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+            try:
+                collection.update_one({"city": city, "lease.owner": owner}, {"$set": {"lease.until": until}})
+            except Exception as e:
+                print(f"[!] Could not renew import lease for {city}: {e}")
+
+
+def max_age():
+    return timedelta(hours=float(os.getenv("CITY_IMPORT_MAX_AGE_HOURS", "168")))
+
+
+_indexed = False
+
+
+def imports_collection():
+    global _indexed
+    collection = get_db()[IMPORTS_COLLECTION]
+    if not _indexed:
+        try:
+            # 租约依赖 city 唯一索引
+            collection.create_index("city", unique=True)
+            _indexed = True
+        except Exception as e:
+            print(f"[!] Could not create index on {IMPORTS_COLLECTION}.city: {e}")
+    return collection
+
+
+def get_import_record(city):
+    return get_db()[IMPORTS_COLLECTION].find_one({"city": city})
+
+
+def is_fresh(record, age=None):
+    if not record or not record.get("importedAt"):
+        return False
+    imported_at = record["importedAt"]
+    if imported_at.tzinfo is None:
+        imported_at = imported_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - imported_at < (age or max_age())
+
+
+def record_import(city, element_count, **fields):
+    collection = imports_collection()
+    record = {"city": city, "importedAt": datetime.now(timezone.utc), "elementCount": element_count}
+    record.update(fields)
+    collection.update_one({"city": city}, {"$set": record}, upsert=True)
+    return record
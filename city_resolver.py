@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from mongo_pool import get_db
+from metrics import external_call, record_payload
+
+load_dotenv()
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lng, precision=6):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+class CityResolver:
+    """Reverse-geocode coordinates to a city name with as few Nominatim calls as possible.
+
+    Lookup order: geohash cell cache -> bounding boxes of stored landmarks
+    (optional) -> Nominatim, throttled to its 1 request/second policy.
+    """
+
+    def __init__(self, precision=None, ttl=None, max_entries=None, use_landmark_bbox=None):
+        # 6 位 geohash 约 1.2 × 0.6 km; 5 位 (约 4.9 km) 的格子常跨越城市边界, 会把邻近城市的结果缓存给整个格子
+        self.precision = precision or int(os.getenv("GEOCODE_CACHE_PRECISION", "6"))
+        self.ttl = ttl if ttl is not None else int(os.getenv("GEOCODE_CACHE_TTL", str(24 * 3600)))
+        self.max_entries = max_entries or int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "10000"))
+        if use_landmark_bbox is None:
+            use_landmark_bbox = os.getenv("GEOCODE_USE_LANDMARK_BBOX", "false").lower() == "true"
+        self.use_landmark_bbox = use_landmark_bbox
+        self.bbox_refresh = int(os.getenv("GEOCODE_BBOX_REFRESH", "600"))
+        self.bbox_min_landmarks = int(os.getenv("GEOCODE_BBOX_MIN_LANDMARKS", "20"))
+        self.min_interval = float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0"))
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._geolocator = None
+        self._nominatimLock = threading.Lock()
+        self._lastNominatimCall = 0.0
+        self._bboxes = []
+        self._bboxesLoadedAt = 0.0
+        self._bboxCache = {}
+
+    def resolve(self, lat, lng):
+        """Return (city, source); city is None when the location has no city."""
+        lat, lng = float(lat), float(lng)
+        cell = geohash(lat, lng, self.precision)
+
+        city = self._cacheGet(cell)
+        if city:
+            return city, "cache"
+
+        if self.use_landmark_bbox:
+            city = self._cityFromLandmarks(lat, lng)
+            if city:
+                self._cachePut(cell, city)
+                return city, "landmarks"
+
+        city = self._reverseNominatim(lat, lng)
+        if city:
+            self._cachePut(cell, city)
+        return city, "nominatim"
+
+    def _cacheGet(self, cell):
+        with self._lock:
+            item = self._cache.get(cell)
+            if item is None:
+                return None
+            city, expires = item
+            if expires < time.time():
+                del self._cache[cell]
+                return None
+            self._cache.move_to_end(cell)
+            return city
+
+    def _cachePut(self, cell, city):
+        with self._lock:
+            self._cache[cell] = (city, time.time() + self.ttl)
+            self._cache.move_to_end(cell)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def cityBoundingBox(self, city):
+        """(south, west, north, east) of a city from Nominatim, or None."""
+        with self._lock:
+            cached = self._bboxCache.get(city)
+        if cached:
+            return cached
+
+        location = self._nominatim(lambda geolocator: geolocator.geocode(
+            city, exactly_one=True, language='en', featuretype="city"
+        ), "geocode")
+        if not location or "boundingbox" not in location.raw:
+            return None
+        south, north, west, east = (float(v) for v in location.raw["boundingbox"])
+        bbox = (south, west, north, east)
+        with self._lock:
+            self._bboxCache[city] = bbox
+        return bbox
+
+    def warmUp(self):
+        """Create the Nominatim client (and load landmark bounding boxes) before the first request."""
+        with self._nominatimLock:
+            self._getGeolocator()
+        if self.use_landmark_bbox:
+            self._loadLandmarkBBoxes()
+        return self
+
+    def _getGeolocator(self):
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent="scavenger-agent")
+        return self._geolocator
+
+    def _nominatim(self, call, operation):
+        # 所有 Nominatim 请求共用一个 geolocator, 并保证最小请求间隔
+        with self._nominatimLock:
+            self._getGeolocator()
+            wait = self._lastNominatimCall + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                with external_call("nominatim", operation):
+                    location = call(self._geolocator)
+                if location is not None:
+                    record_payload("nominatim", location.raw)
+                return location
+            finally:
+                self._lastNominatimCall = time.time()
+
+    def _reverseNominatim(self, lat, lng):
+        location = self._nominatim(lambda geolocator: geolocator.reverse(f"{lat}, {lng}", language='en'), "reverse")
+
+        if not location:
+            return None
+        address = location.raw.get("address", {})
+        return address.get("city") or address.get("town") or address.get("village")
+
+    def _cityFromLandmarks(self, lat, lng):
+        if time.time() - self._bboxesLoadedAt > self.bbox_refresh:
+            self._loadLandmarkBBoxes()
+
+        # 只有唯一匹配时才采用, 边界重叠时仍交给 Nominatim
+        matches = [city for city, (min_lat, min_lng, max_lat, max_lng) in self._bboxes
+                   if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng]
+        return matches[0] if len(matches) == 1 else None
+
+    def _loadLandmarkBBoxes(self):
+        pipeline = [
+            {"$match": {"city": {"$nin": [None, ""]}}},
+            {"$group": {
+                "_id": "$city",
+                "minLat": {"$min": "$centroid.latitude"},
+                "maxLat": {"$max": "$centroid.latitude"},
+                "minLng": {"$min": "$centroid.longitude"},
+                "maxLng": {"$max": "$centroid.longitude"},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gte": self.bbox_min_landmarks}}}
+        ]
+        try:
+            self._bboxes = [
+                (doc["_id"], (doc["minLat"], doc["minLng"], doc["maxLat"], doc["maxLng"]))
+                for doc in get_db()["landmarks"].aggregate(pipeline)
+            ]
+        except Exception as e:
+            print(f"[ResolveCity] Could not load landmark bounding boxes: {e}")
+        self._bboxesLoadedAt = time.time()
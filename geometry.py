@@ -0,0 +1,212 @@
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# 所有地标的坐标打包成连续数组:
+#   lat, lon: 全部顶点
+#   offsets:  第 i 个地标的顶点为 [offsets[i], offsets[i+1])
+
+
+def element_geometry(entry):
+    """Vertex list of an Overpass element as [{"lat", "lon"}, ...]."""
+    if entry.get("geometry"):
+        return entry["geometry"]
+    if "lat" in entry and "lon" in entry:
+        return [{"lat": entry["lat"], "lon": entry["lon"]}]
+    if entry.get("members"):
+        return relation_outer_ring(entry["members"])
+    return []
+
+
+def relation_outer_ring(members):
+    """Largest outer ring of a multipolygon relation (``out geom``), stitched
+    together from its member ways."""
+    segments = [
+        [pt for pt in member["geometry"] if pt]
+        for member in members
+        if member.get("type") == "way" and member.get("role", "outer") in ("outer", "") and member.get("geometry")
+    ]
+    rings = _stitch(seg for seg in segments if len(seg) >= 2)
+    if not rings:
+        return []
+    # 取面积最大的环 (经纬度平面上的近似面积即可比较大小)
+    return max(rings, key=lambda ring: (ring[0] == ring[-1], abs(_shoelace(ring))))
+
+
+def _stitch(segments):
+    # 首尾相接的 way 拼成环, 需要时反转方向
+    pending = [list(seg) for seg in segments]
+    rings = []
+    while pending:
+        ring = pending.pop()
+        joined = True
+        while joined and ring[0] != ring[-1]:
+            joined = False
+            for i, seg in enumerate(pending):
+                if seg[0] == ring[-1]:
+                    ring = ring + seg[1:]
+                elif seg[-1] == ring[-1]:
+                    ring = ring + seg[-2::-1]
+                elif seg[-1] == ring[0]:
+                    ring = seg[:-1] + ring
+                elif seg[0] == ring[0]:
+                    ring = seg[:0:-1] + ring
+                else:
+                    continue
+                del pending[i]
+                joined = True
+                break
+        rings.append(ring)
+    return rings
+
+
+def _shoelace(ring):
+    return sum(a["lon"] * b["lat"] - b["lon"] * a["lat"] for a, b in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+def pack_geometries(geometries):
+    counts = np.fromiter((len(g) for g in geometries), dtype=np.int64, count=len(geometries))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    total = int(offsets[-1])
+    lat = np.fromiter(map(itemgetter("lat"), chain.from_iterable(geometries)), dtype=np.float64, count=total)
+    lon = np.fromiter(map(itemgetter("lon"), chain.from_iterable(geometries)), dtype=np.float64, count=total)
+    return lat, lon, offsets
+
+
+def compute_geometry_stats(lat, lon, offsets):
+    """Area-weighted centroid, bbox, area (m^2) and perimeter (m) per landmark.
+
+    Each ring is projected to local equirectangular metres around its first
+    vertex. Open ways, single nodes and degenerate rings fall back to the
+    vertex mean with zero area.
+    """
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    counts = ends - starts
+    n = len(lat)
+
+    lat0 = lat[starts]
+    lon0 = lon[starts]
+    cos0 = np.cos(np.radians(lat0))
+    x, y = _local_xy(lat, lon, offsets)
+
+    # 每个顶点的下一个顶点, 最后一个顶点回到环的起点
+    nxt = np.arange(1, n + 1)
+    nxt[ends - 1] = starts
+    x1 = x[nxt]
+    y1 = y[nxt]
+
+    cross = x * y1 - x1 * y
+    seg = np.hypot(x1 - x, y1 - y)
+
+    area2 = np.add.reduceat(cross, starts)
+    cx = np.add.reduceat((x + x1) * cross, starts)
+    cy = np.add.reduceat((y + y1) * cross, starts)
+    perimeter = np.add.reduceat(seg, starts)
+
+    closed = (counts >= 4) & (lat[ends - 1] == lat0) & (lon[ends - 1] == lon0)
+    polygon = closed & (np.abs(area2) > 1e-6)
+    # 非闭合 way 不计算首尾连线
+    perimeter = np.where(closed, perimeter, perimeter - seg[ends - 1])
+
+    safe = np.where(polygon, area2, 1.0)
+    mean_lat = np.add.reduceat(lat, starts) / counts
+    mean_lon = np.add.reduceat(lon, starts) / counts
+    centroid_lat = np.where(polygon, lat0 + np.degrees(cy / (3 * safe) / EARTH_RADIUS_M), mean_lat)
+    centroid_lon = np.where(polygon, lon0 + np.degrees(cx / (3 * safe) / (EARTH_RADIUS_M * cos0)), mean_lon)
+
+    return {
+        "latitude": centroid_lat,
+        "longitude": centroid_lon,
+        "minLat": np.minimum.reduceat(lat, starts),
+        "minLon": np.minimum.reduceat(lon, starts),
+        "maxLat": np.maximum.reduceat(lat, starts),
+        "maxLon": np.maximum.reduceat(lon, starts),
+        "area": np.where(polygon, np.abs(area2) / 2, 0.0),
+        "perimeter": perimeter,
+    }
+
+
+def simplify_mask(lat, lon, offsets, tolerance):
+    """Douglas-Peucker keep-mask over all packed vertices, tolerance in metres.
+
+    All rings are simplified together, one recursion level per pass. Closed
+    rings keep at least four vertices; otherwise they are left as is.
+    """
+    n = len(lat)
+    if tolerance <= 0 or not n:
+        return np.ones(n, dtype=bool)
+    x, y = _local_xy(lat, lon, offsets)
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    counts = ends - starts
+
+    # 四个顶点以内的环无法再简化, 整体保留
+    keep = np.repeat(counts <= 4, counts)
+    keep[starts] = True
+    keep[ends - 1] = True
+
+    # 闭合环 (局部坐标以首顶点为原点, 末顶点也在原点) 先在离起点最远的顶点处切开
+    closed = (counts > 4) & (x[ends - 1] == 0) & (y[ends - 1] == 0)
+    dist = np.hypot(x, y)
+    farthest = _group_argmax(dist, np.repeat(np.arange(len(counts)), counts), np.repeat(closed, counts))
+    keep[farthest] = True
+
+    while True:
+        candidates = np.flatnonzero(~keep)
+        if not len(candidates):
+            break
+        kept = np.flatnonzero(keep)
+        pos = np.searchsorted(kept, candidates)
+        first = kept[pos - 1]
+        last = kept[pos]
+
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[candidates] - x[first]
+        py = y[candidates] - y[first]
+        length = np.hypot(dx, dy)
+        dist = np.where(length > 0, np.abs(px * dy - py * dx) / np.where(length > 0, length, 1.0), np.hypot(px, py))
+
+        # 每段 (相邻两个保留顶点之间) 取距离最大的顶点
+        split = _group_argmax(dist, first, dist > tolerance)
+        if not len(split):
+            break
+        keep[candidates[split]] = True
+
+    kept_counts = np.add.reduceat(keep, starts)
+    # 简化后不足四个顶点的闭合环保留原样
+    collapsed = closed & (kept_counts < 4)
+    if collapsed.any():
+        keep[np.repeat(collapsed, counts)] = True
+    return keep
+
+
+def _local_xy(lat, lon, offsets):
+    # 以每个地标的第一个顶点为原点的局部等距投影 (米)
+    starts = offsets[:-1]
+    counts = offsets[1:] - starts
+    lat0 = np.repeat(lat[starts], counts)
+    cos0 = np.cos(np.radians(lat0))
+    x = np.radians(lon - np.repeat(lon[starts], counts)) * EARTH_RADIUS_M * cos0
+    y = np.radians(lat - lat0) * EARTH_RADIUS_M
+    return x, y
+
+
+def _group_argmax(values, groups, eligible):
+    """Index of the first maximum of ``values`` in each run of equal ``groups``
+    (sorted), for runs whose maximum element is ``eligible``."""
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    bounds = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    maxima = np.maximum.reduceat(values, bounds)
+    sizes = np.diff(np.r_[bounds, len(values)])
+    hits = np.flatnonzero((values == np.repeat(maxima, sizes)) & eligible)
+    run = np.searchsorted(bounds, hits, side="right") - 1
+    _, first = np.unique(run, return_index=True)
+    return hits[first]
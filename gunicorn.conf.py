@@ -0,0 +1,56 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# 多进程 + 每进程多线程: 一个耗时的 /fetch-landmark 不会阻塞其他请求, CPU 密集的解析和几何计算可以用满所有核
+# 城市导入和元数据任务通过 MongoDB 协调, /metrics 合并所有 worker 的指标
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 各 worker 把指标快照写入该目录, /metrics 合并所有 worker 的值 (见 metrics.py)
+# 在 master 中设置, fork 出的 worker 继承; 服务启动时清空
+os.environ.setdefault("METRICS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"landmark_metrics_{os.getpid()}"))
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', '5000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# 整个城市的导入可能需要几分钟
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+# 收到 SIGTERM 后等待进行中的请求 (城市导入) 完成的时间
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "300"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    shutil.rmtree(os.environ["METRICS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["METRICS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ["METRICS_MULTIPROC_DIR"], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # mongo_pool 通过 os.register_at_fork 丢弃父进程的客户端; 这里只做记录
+    server.log.info(f"[→] Worker {worker.pid} forked")
+
+
+def post_worker_init(worker):
+    # 在开始接受请求前建立 MongoDB 连接, 打开共享的客户端和缓存
+    from app import warm_up
+    warm_up()
+
+
+def worker_exit(server, worker):
+    # 进行中的请求已结束, 等待后台元数据任务完成再退出
+    from app import drain
+    drain()
@@ -1,99 +1,145 @@
 #!/usr/bin/env python3
 """
 使用现有的 LandmarkPreprocessor 类手动注入地标
+
+    python inject_way.py --city Mallow 182676960 r1234567
+    python inject_way.py --city Cork --file curated_ids.txt --overwrite
+
+ID 格式: 纯数字或 w123 / way/123 为 way, r123 / relation/123 为 relation.
+文件中每行一个 ID, # 开头为注释.
 """
 
+import argparse
+import json
+import re
+import sys
+
 from landmark_preprocessor import LandmarkPreprocessor
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import GEOSPHERE
 from dotenv import load_dotenv
-import os
-from landmark_meta_generator import LandmarkMetaGenerator
+from mongo_pool import get_db
 
 load_dotenv()
 
-# 配置
-WAY_ID = 182676960
-CITY = "Mallow"
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME = os.getenv("MONGO_DB", "scavengerhunt")
-
-# 构建查询特定 way 的 Overpass 查询
-query = f"""
-[out:json];
-way({WAY_ID});
-out geom;
-"""
+ID_PATTERN = re.compile(r"^(?:(w|way|r|rel|relation)[/:]?)?(\d+)$", re.IGNORECASE)
+
+
+def parse_ids(values):
+    """[(osm_type, id), ...] in input order without duplicates."""
+    ids = {}
+    for value in values:
+        match = ID_PATTERN.match(value.strip())
+        if not match:
+            raise ValueError(f"Invalid OSM id: {value}")
+        prefix = (match.group(1) or "w").lower()
+        ids[("relation" if prefix.startswith("r") else "way", int(match.group(2)))] = None
+    return list(ids)
+
+
+def read_id_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+
+
+def build_id_query(ids, timeout=180):
+    ways = [str(i) for t, i in ids if t == "way"]
+    relations = [str(i) for t, i in ids if t == "relation"]
+    parts = []
+    if ways:
+        parts.append(f"way(id:{','.join(ways)});")
+    if relations:
+        parts.append(f"relation(id:{','.join(relations)});")
+    return f"""
+    [out:json][timeout:{timeout}];
+    (
+        {' '.join(parts)}
+    );
+    out geom meta;
+    """
+
 
-print(f"[*] 查询 way {WAY_ID}...")
+def fetch_elements(ids, city, chunk_size):
+    # 每个查询最多 chunk_size 个 ID, 避免 URL / 查询过长
+    elements = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        print(f"[*] 查询 {len(chunk)} 个要素 ({start + 1}-{start + len(chunk)}/{len(ids)})...")
+        processor = LandmarkPreprocessor(build_id_query(chunk), city=city).fetchRaw()
+        elements += json.loads(processor.rawData)["elements"]
+    return elements
 
-# 使用你的 LandmarkPreprocessor 类处理
-processor = LandmarkPreprocessor(query, city=CITY)
-processor.fetchRaw()
-processor.findRawLandmarks()
-processor.processRawLandmark()
 
-# 存储到 landmarks 集合（使用你代码中的处理逻辑）
-if processor.processedLandmarks:
-    client = MongoClient(MONGO_URL)
-    db = client[DB_NAME]
-    collection = db["landmarks"]
-    
+def inject(ids, city, chunk_size=500, overwrite=False, generate_meta=True):
+    elements = fetch_elements(ids, city, chunk_size)
+    found = {(entry.get("type"), entry.get("id")) for entry in elements}
+    for osm_type, osm_id in ids:
+        if (osm_type, osm_id) not in found:
+            print(f"[!] 未找到 {osm_type}/{osm_id}")
+
+    # 手动挑选的要素同名也全部保留, 按 OSM id 区分
+    processor = LandmarkPreprocessor("", city=city, source="inject")
+    processor.rawElements = elements
+    processor.findRawLandmarks(keep_duplicates=True).processRawLandmark()
+    if not processor.processedLandmarks:
+        print("[✗] 没有处理后的地标数据")
+        return []
+
+    collection = get_db()["landmarks"]
     # 创建地理索引（如果需要）
     try:
         collection.create_index([("geometry", GEOSPHERE)])
     except Exception:
         pass
-    
-    inserted_ids = []  # 保存插入的地标 ID
-    
-    for name, data in processor.processedLandmarks.items():
-        # 构建标准格式：centroid 对象
-        centroid = {
-            "latitude": data["latitude"],
-            "longitude": data["longitude"]
-        }
-        
-        # 转换为 GeoJSON Polygon 格式（数据库标准格式）
-        coordinates = [[pt["lon"], pt["lat"]] for pt in data["geometry"]]
-        # 闭合多边形
-        if coordinates[0] != coordinates[-1]:
-            coordinates.append(coordinates[0])
-        
-        geometry_geojson = {
-            "type": "Polygon",
-            "coordinates": [coordinates]
-        }
-        
-        entry = {
-            "name": name,
-            "city": CITY,
-            "centroid": centroid,
-            "geometry": geometry_geojson,
-            "tags": data.get("tags", {}),
-            "riddle": None
-        }
-        
-        # 检查是否已存在
-        existing = collection.find_one({"name": name, "city": CITY})
-        if existing:
-            print(f"[→] 已存在: {name} (城市: {CITY})")
-            inserted_ids.append(str(existing["_id"]))  # 保存已存在的地标 ID
-        else:
-            result = collection.insert_one(entry)
-            inserted_ids.append(str(result.inserted_id))  # 保存新插入的地标 ID
-            print(f"[✓] 已插入: {name} (城市: {CITY})")
-    
-    client.close()  # 现在可以安全关闭了
-    
-    # 如果需要生成 metadata，使用 LandmarkMetaGenerator
-    if inserted_ids:
-        print("\n[*] 生成 metadata...")
-        generator = LandmarkMetaGenerator()
-        generator.loadLandmarksFromDB(inserted_ids)
-        generator.fetchWiki().fetchOpenAI()
-        generator.storeToDB(collection_name="landmark_metadata", overwrite=False)
-        print("[✓] Metadata 生成完成!")
-    
+
+    processor.storeToDB(overwrite=overwrite)
+
+    # 取回本次注入的地标 ID
+    landmark_ids = []
+    for osm_type in ("way", "relation"):
+        osm_ids = [package["osmId"] for package in processor.processedLandmarks.values() if package["osmType"] == osm_type]
+        if osm_ids:
+            landmark_ids += [str(doc["_id"]) for doc in collection.find(
+                {"city": city, "osmType": osm_type, "osmId": {"$in": osm_ids}}, {"_id": 1}
+            )]
+    print(f"[✓] 已注入 {len(landmark_ids)} 个地标 (城市: {city})")
+
+    if generate_meta and landmark_ids:
+        # 已有 metadata 的地标跳过, 其余一次性批量生成
+        existing = {doc["landmarkId"] for doc in get_db()["landmark_metadata"].find(
+            {"landmarkId": {"$in": landmark_ids}}, {"landmarkId": 1, "_id": 0}
+        )}
+        pending = [lm_id for lm_id in landmark_ids if lm_id not in existing]
+        if pending:
+            print(f"\n[*] 为 {len(pending)} 个地标生成 metadata...")
+            from landmark_meta_generator import LandmarkMetaGenerator
+            LandmarkMetaGenerator()\
+                .loadLandmarksFromDB(pending)\
+                .fetchWiki()\
+                .fetchOpenAI()\
+                .storeToDB(collection_name="landmark_metadata", overwrite=False)
+            print("[✓] Metadata 生成完成!")
+    return landmark_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inject OSM ways/relations as landmarks.")
+    parser.add_argument("ids", nargs="*", help="OSM ids: 123 / w123 / way/123 / r123 / relation/123")
+    parser.add_argument("--file", help="File with one OSM id per line")
+    parser.add_argument("--city", required=True)
+    parser.add_argument("--chunk-size", type=int, default=500, help="Ids per Overpass query")
+    parser.add_argument("--overwrite", action="store_true", help="Update geometry/tags of existing landmarks")
+    parser.add_argument("--no-meta", action="store_true", help="Skip metadata generation")
+    args = parser.parse_args(argv)
+
+    values = list(args.ids) + (read_id_file(args.file) if args.file else [])
+    if not values:
+        parser.error("no OSM ids given")
+    ids = parse_ids(values)
+
+    landmark_ids = inject(ids, args.city, args.chunk_size, args.overwrite, not args.no_meta)
     print("\n[✓] 完成!")
-else:
-    print("[✗] 没有处理后的地标数据")
\ No newline at end of file
+    return 0 if landmark_ids else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,28 +2,47 @@ import requests
 import json
 import os
 import re
-import wikipedia
+import threading
 
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 from bson import ObjectId
 
+from bulk_writer import bulk_upsert, summarize
+from mongo_pool import get_db
+from rate_limit import TokenBucket, call_with_backoff
+from llm_cache import LLMCache
+from metrics import in_context, measured, record_payload, timed
+
 load_dotenv()
 
+# 每个进程共享的上游限流 (请求/秒)
+WIKI_BUCKET = TokenBucket(float(os.getenv("WIKI_RATE_LIMIT", "20")))
+OPENAI_BUCKET = TokenBucket(float(os.getenv("OPENAI_RATE_LIMIT", "5")))
+
 class LandmarkMetaGenerator:
-    def __init__(self, mode="openai"):
+    def __init__(self, mode="openai", llm_cache=None, bypass_cache=None):
         self.api_key = os.getenv("OPENAI_API_KEY", "")
-        self.mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017")
         self.db_name = os.getenv("MONGO_DB", "scavengerhunt")
         self.mode = mode  
         self.metaInfo = {}
         self.landmarks = []
-
+        self.writeStats = []
+        self.workers = int(os.getenv("META_WORKERS", "4"))
+        # >1 时每次 LLM 请求同时校验/总结多个地标
+        self.batch_size = int(os.getenv("META_LLM_BATCH_SIZE", "1"))
+        self.llmCache = llm_cache or LLMCache()
+        if bypass_cache is None:
+            bypass_cache = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+        self.bypass_cache = bypass_cache
+        # offline: 只使用缓存中的回复, 未命中时报错 (用于离线测试)
+        self.offline = os.getenv("LLM_CACHE_OFFLINE", "false").lower() == "true"
+
+    @timed("meta.loadLandmarksFromDB", lambda self: len(self.landmarks))
     def loadLandmarksFromDB(self, landmark_ids=None):
-        client = MongoClient(self.mongo_url)
-        db = client[self.db_name]
+        db = get_db(self.db_name)
         collection = db.landmarks
 
         query = {}
@@ -45,66 +64,246 @@ class LandmarkMetaGenerator:
             print(f"[✓] Loaded {len(self.landmarks)} landmarks from DB.")
         return self
     
-    def fetchWiki(self):
+    @timed("meta.fetchWiki", lambda self: len(self.landmarks))
+    def fetchWiki(self, workers=None, batch_size=None):
+        batch_size = batch_size or self.batch_size
         for lm_id, lm, city in self.landmarks:
             if lm_id not in self.metaInfo:
                     self.metaInfo[lm_id] = {}
                     self.metaInfo[lm_id]["name"] = lm
                     self.metaInfo[lm_id]["city"] = city
-            try:
-                page = wikipedia.page(lm, auto_suggest=True)
-                print(f"[✓] Processing Wiki Page: {lm}")
-                
-                if "meta" not in self.metaInfo[lm_id]:
-                    self.metaInfo[lm_id]["meta"] = {}
-                self.metaInfo[lm_id]["meta"]["url"] = page.url
-                self.metaInfo[lm_id]["meta"]["summary"] = page.summary
-                self.metaInfo[lm_id]["meta"]["images"] = [img for img in page.images if img.lower().endswith((".jpg", ".jpeg", ".png"))]
-                
-                ### APPLY AI INSPECTION
-                if self._aiInsepection(lm, city, page.summary) == True:
-                    # if wiki is found, replace summary with detail
-                    self.metaInfo[lm_id]["meta"]["wikipedia"] = page.content
-                    self.metaInfo[lm_id]["meta"].pop("summary")
-                else:
-                    # found wiki is falsed. remove from library
-                    self.metaInfo[lm_id].pop("meta")
 
-            except wikipedia.exceptions.DisambiguationError as e:
-                print(f"[!] {lm} disambiguation: {e.options[:3]}")
+        # 并发抓取, 结果在主线程写回 metaInfo
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as executor:
+            if batch_size > 1:
+                results = self._fetchWikiBatched(executor, batch_size)
+            else:
+                futures = {
+                    executor.submit(in_context(self._fetchWikiPage), lm, city): lm_id
+                    for lm_id, lm, city in self.landmarks
+                }
+                results = ((futures[future], *future.result()) for future in as_completed(futures))
 
-            except wikipedia.exceptions.PageError:
-                print(f"[!] {lm} page not found.")
+            for lm_id, status, meta in results:
+                if status == "verified":
+                    self.metaInfo[lm_id].setdefault("meta", {}).update(meta)
+                elif status == "rejected":
+                    # found wiki is falsed. remove from library
+                    self.metaInfo[lm_id].pop("meta", None)
         return self
 
-    
-    def fetchOpenAI(self):
-        for lm_id in self.metaInfo:
-            if "meta" not in self.metaInfo[lm_id]:
-                self.metaInfo[lm_id]["meta"] = {}
-                    
-            lm_name = self.metaInfo[lm_id]["name"]
-            lm_city = self.metaInfo[lm_id]["city"]
-
-            content = self.metaInfo[lm_id].get("meta", {}).get("wikipedia")
-            image_urls = self.metaInfo[lm_id].get("meta", {}).get("images")
+    def _fetchWikiBatched(self, executor, batch_size):
+        # 1. 并发抓取页面和摘要
+        futures = {
+            executor.submit(in_context(self._fetchWikiPage), lm, city, False): (lm_id, lm, city)
+            for lm_id, lm, city in self.landmarks
+        }
+        found = []
+        for future in as_completed(futures):
+            lm_id, lm, city = futures[future]
+            status, page = future.result()
+            if status == "found":
+                found.append((lm_id, lm, city, page))
+            else:
+                yield lm_id, status, None
+
+        # 2. 多个地标合并到一次请求中校验
+        items = [(lm_id, lm, city, page["summary"]) for lm_id, lm, city, page in found]
+        verdicts = {}
+        for result in executor.map(in_context(self._aiInspectBatch), _chunks(items, batch_size)):
+            verdicts.update(result)
+
+        # 3. 只为校验通过的页面抓取全文
+        verified = [(lm_id, page) for lm_id, _, _, page in found if verdicts.get(lm_id) == True]
+        contents = executor.map(in_context(lambda item: self._wiki(lambda: item[1]["page"].content)), verified)
+        for (lm_id, page), content in zip(verified, contents):
+            yield lm_id, "verified", {**page["meta"], "wikipedia": content}
+        for lm_id, _, _, _ in found:
+            if verdicts.get(lm_id) != True:
+                yield lm_id, "rejected", None
+
+    def _fetchWikiPage(self, lm, city, inspect=True):
+        wikipedia = _wikipedia_module()
+        try:
+            page = self._wiki(lambda: wikipedia.page(lm, auto_suggest=True))
+            print(f"[✓] Processing Wiki Page: {lm}")
 
+            summary = self._wiki(lambda: page.summary)
+            meta = {
+                "url": page.url,
+                "images": [img for img in self._wiki(lambda: page.images) if img.lower().endswith((".jpg", ".jpeg", ".png"))]
+            }
+            if not inspect:
+                return "found", {"page": page, "summary": summary, "meta": meta}
+
+            ### APPLY AI INSPECTION
+            if self._aiInsepection(lm, city, summary) == True:
+                # if wiki is found, replace summary with detail
+                meta["wikipedia"] = self._wiki(lambda: page.content)
+                return "verified", meta
+            return "rejected", None
+
+        except wikipedia.exceptions.DisambiguationError as e:
+            print(f"[!] {lm} disambiguation: {e.options[:3]}")
+
+        except wikipedia.exceptions.PageError:
+            print(f"[!] {lm} page not found.")
+        return "missing", None
+
+    @staticmethod
+    def _wiki(fn):
+        result = call_with_backoff(lambda: measured("wikipedia", fn), bucket=WIKI_BUCKET)
+        # 页面对象本身不计; summary / content / images 记录大小
+        record_payload("wikipedia", result)
+        return result
+
+    @staticmethod
+    def _openai(fn):
+        return call_with_backoff(lambda: measured("openai", fn, "chat"), bucket=OPENAI_BUCKET)
+
+    def _chat(self, model, messages, refresh=False, **params):
+        # 相同 model + messages (含图片 URL) + 参数 直接复用缓存的回复
+        key = LLMCache.key(model, messages, **params)
+        if not self.bypass_cache and not refresh:
+            cached = self.llmCache.get(key)
+            if cached is not None:
+                return cached
+        if self.offline:
+            raise LookupError(f"No cached LLM response for {model} request {key[:12]} (offline mode)")
+
+        client = _openai_client(self.api_key)
+        response = self._openai(lambda: client.chat.completions.create(model=model, messages=messages, **params))
+        text = response.choices[0].message.content
+        record_payload("openai", text)
+        if not self.bypass_cache:
+            self.llmCache.put(key, model, text)
+        return text
+
+    @timed("meta.fetchOpenAI", lambda self: len(self.metaInfo))
+    def fetchOpenAI(self, workers=None, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        pending = []
+        for lm_id in self.metaInfo:
             if "meta" not in self.metaInfo[lm_id]:
                 self.metaInfo[lm_id]["meta"] = {}
 
             desc = self.metaInfo[lm_id]["meta"].get("description")
             if desc is None or desc == {}:
-                print(f"[!] Description for {lm_name} is not found! Initializing Description.")
-                result = self._aiSummarizeLandmark(lm_name, lm_city, content, image_urls)
-                self.metaInfo[lm_id]["meta"]["description"] = result.get("metadata", {})
+                print(f"[!] Description for {self.metaInfo[lm_id]['name']} is not found! Initializing Description.")
+                pending.append(lm_id)
+
+        items = []
+        for lm_id in pending:
+            info = self.metaInfo[lm_id]
+            items.append((lm_id, info["name"], info["city"], info["meta"].get("wikipedia"), info["meta"].get("images")))
+
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as executor:
+            if batch_size > 1:
+                futures = [executor.submit(in_context(self._aiSummarizeBatch), chunk) for chunk in _chunks(items, batch_size)]
+            else:
+                futures = [
+                    executor.submit(in_context(lambda item: {item[0]: self._aiSummarizeLandmark(*item[1:])}), item)
+                    for item in items
+                ]
+            for future in as_completed(futures):
+                for lm_id, result in future.result().items():
+                    self.metaInfo[lm_id]["meta"]["description"] = result.get("metadata", {})
 
         return self
 
+    def _aiInspectBatch(self, items):
+        """Verify several (lm_id, name, city, summary) items with one request; returns {lm_id: bool}."""
+        if len(items) == 1:
+            lm_id, lm_name, lm_city, content = items[0]
+            return {lm_id: self._aiInsepection(lm_name, lm_city, content)}
+
+        entries = "\n".join(
+            f'{i}. Target Landmark: "{lm_name}"; City: "{lm_city}"; Text: """{_truncate(content)}"""'
+            for i, (_, lm_name, lm_city, content) in enumerate(items, 1)
+        )
+        prompt = f"""
+        You are verifying if Wikipedia articles are about specific landmarks.
+        For each numbered item below, decide whether the text is clearly about the target landmark.
+
+        {entries}
+
+        Respond ONLY with a JSON array containing one object per item, e.g.
+        [{{"id": 1, "match": true}}, {{"id": 2, "match": false}}]
+        """
+
+        try:
+            text = self._chat(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": "You are a precise document verifier."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=20 * len(items) + 20
+            )
+            verdicts = _parseBatchReply(text, len(items))
+            return {items[i - 1][0]: reply["match"] == True for i, reply in verdicts.items()}
+        except Exception as e:
+            # 回复格式不对: 拆成两半分别重试
+            print(f"[!] Batch verification of {len(items)} landmarks failed ({e}), splitting batch.")
+            half = len(items) // 2
+            return {**self._aiInspectBatch(items[:half]), **self._aiInspectBatch(items[half:])}
+
+    def _aiSummarizeBatch(self, items):
+        """Summarize several (lm_id, name, city, content, images) items with one request;
+        returns {lm_id: result} in the shape of _aiSummarizeLandmark."""
+        if len(items) == 1:
+            lm_id, *args = items[0]
+            return {lm_id: self._aiSummarizeLandmark(*args)}
+
+        content = [{"type": "text", "text": """
+        Provide structured information about each of the following real-world landmarks.
+
+        history: Highlight significant events or periods related to the landmark.\
+        architecture: Mention unique structural or design features, pay attention to color\
+        significance: Emphasize its cultural, religious, or social importance.\
+        Each in 5~10 keywords.
+
+        Respond ONLY with a JSON array containing one object per landmark, in this format:
+        [{"id": 1, "history": [...], "architecture": [...], "significance": [...]}]
+
+        Do not include any explanation or commentary.
+        If unsure about a landmark, reply for it exactly with: {"id": <id>, "status": "unknown"}
+        """}]
+        for i, (_, lm_name, lm_city, text, image_urls) in enumerate(items, 1):
+            content.append({"type": "text", "text": f'Landmark {i}: "{lm_name}" located in "{lm_city}". Additional information: {_truncate(text) or "None"}'})
+            content += [{"type": "image_url", "image_url": {"url": url, "detail": "high"}} for url in (image_urls or [])[:5]]
+
+        try:
+            text = self._chat(
+                model="gpt-4-turbo",
+                messages=[{"role": "user", "content": content}],
+                temperature=0.5,
+                max_tokens=min(4096, 400 * len(items))
+            )
+            replies = _parseBatchReply(text, len(items))
+        except Exception as e:
+            print(f"[!] Batch summarization of {len(items)} landmarks failed ({e}), splitting batch.")
+            half = len(items) // 2
+            return {**self._aiSummarizeBatch(items[:half]), **self._aiSummarizeBatch(items[half:])}
+
+        results = {}
+        for i, reply in replies.items():
+            lm_id, lm_name = items[i - 1][0], items[i - 1][1]
+            if reply.get("status") == "unknown":
+                print(f"[x] GPT did not recognize: {lm_name}")
+                results[lm_id] = {
+                    "source": "openai",
+                    "confidence": False,
+                    "message": "LLM could not confirm landmark identity."
+                }
+            else:
+                reply.pop("id", None)
+                results[lm_id] = {"source": "openai", "confidence": True, "metadata": reply}
+        return results
 
     def _aiSummarizeLandmark(self, lm_name, lm_city, content=None, image_urls=None, retry_count=0):
         # generate something similiar to wikipedia?
-        client = OpenAI(api_key=self.api_key)
-        
         if not content:
             content = "None"
 
@@ -133,7 +332,7 @@ class LandmarkMetaGenerator:
         """
 
         try:
-            response = client.chat.completions.create(
+            text = self._chat(
                 model="gpt-4-turbo",
                 messages=[
                     # {"role": "system", "content": "You are a precise document verifier."},
@@ -144,10 +343,11 @@ class LandmarkMetaGenerator:
                      }
                 ],
                 temperature=0.5,
-                max_tokens=500
+                max_tokens=500,
+                # 重试时不读缓存, 避免重复拿到同一个无法解析的回复
+                refresh=retry_count > 0
             )
 
-            text = response.choices[0].message.content
             text = re.sub(r"```(?:json)?", "", text).replace("```", "").strip()
 
             if "not recognized" in text.lower():
@@ -188,8 +388,6 @@ class LandmarkMetaGenerator:
             }
     
     def _aiInsepection(self, lm_name, lm_city, content):
-        client = OpenAI(api_key=self.api_key)
-        
         prompt = f"""
         You are verifying if a Wikipedia article is about a specific landmark.
         Target Landmark: "{lm_name}"
@@ -202,7 +400,7 @@ class LandmarkMetaGenerator:
         """
 
         try:
-            response = client.chat.completions.create(
+            reply = self._chat(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "You are a precise document verifier."},
@@ -210,8 +408,7 @@ class LandmarkMetaGenerator:
                 ],
                 temperature=0.2,
                 max_tokens=5
-            )
-            reply = response.choices[0].message.content.strip().lower()
+            ).strip().lower()
             return reply.startswith("true")
 
         except Exception as e:
@@ -224,15 +421,20 @@ class LandmarkMetaGenerator:
         with open(path, 'w', encoding='utf-8') as f:
             json.dump(self.metaInfo, f, ensure_ascii=False, indent=4)
 
+    @timed("meta.storeToDB", lambda self: len(self.metaInfo))
     def storeToDB(self, collection_name="landmark_metadata", overwrite=False):
-        client = MongoClient(self.mongo_url)
-        db = client[self.db_name]
+        db = get_db(self.db_name)
         collection = db[collection_name]
 
-        inserted_count = 0
-        skipped_count = 0
-        updated_count = 0
+        # 唯一索引是跳过逻辑的前提: 已有完整数据时 upsert 会触发 duplicate key 而被计为跳过
+        try:
+            collection.create_index("landmarkId", unique=True)
+        except Exception:
+            print("[!] Unique index creation failed, cleaning duplicates first...")
+            self._dedupeMetadata(collection)
+            collection.create_index("landmarkId", unique=True)
 
+        operations = []
         for lm_id, info in self.metaInfo.items():
             entry = {
                 "landmarkId": lm_id,
@@ -241,32 +443,89 @@ class LandmarkMetaGenerator:
                 "meta": info.get("meta", {})
             }
 
-            # 检查数据库中是否已存在该地标
-            existing = collection.find_one({"landmarkId": lm_id})
-            
-            if existing:
-                if overwrite:
-                    # 如果设置了overwrite，更新现有记录
-                    collection.update_one(
-                        {"landmarkId": lm_id},
-                        {"$set": entry}
-                    )
-                    updated_count += 1
-                    print(f"[↻] Updated: {info['name']}")
-                else:
-                    # 如果已存在且不覆盖，跳过
-                    skipped_count += 1
-                    print(f"[→] Skipped (already exists): {info['name']}")
+            if overwrite:
+                selector = {"landmarkId": lm_id}
             else:
-                # 不存在则插入新记录
-                collection.insert_one(entry)
-                inserted_count += 1
-                print(f"[✓] Inserted: {info['name']}")
+                # 只替换没有完整 description 的记录
+                selector = {"landmarkId": lm_id, "$or": [{"meta.description": None}, {"meta.description": {}}]}
+            operations.append(UpdateOne(selector, {"$set": entry}, upsert=True))
+
+        self.writeStats = bulk_upsert(collection, operations)
+        total = summarize(self.writeStats)
 
         print(f"\n[Summary] Collection: {collection_name}")
-        print(f"  - Inserted: {inserted_count}")
-        print(f"  - Skipped: {skipped_count}")
-        print(f"  - Updated: {updated_count}")
+        print(f"  - Batches: {total['batches']}")
+        print(f"  - Inserted: {total['inserted']}")
+        print(f"  - Updated: {total['updated']}")
+        print(f"  - Skipped: {total['skipped']}")
+        print(f"  - Failed: {total['failed']}")
+        return self
+
+    def _dedupeMetadata(self, collection):
+        # 每个 landmarkId 保留一条记录 (优先保留有 description 的), 其余删除
+        pipeline = [
+            {"$group": {
+                "_id": "$landmarkId",
+                "docs": {"$push": {"_id": "$_id", "complete": {"$gt": ["$meta.description", {}]}}},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        stale = []
+        for group in collection.aggregate(pipeline):
+            docs = sorted(group["docs"], key=lambda d: not d["complete"])
+            stale.extend(doc["_id"] for doc in docs[1:])
+        if stale:
+            result = collection.delete_many({"_id": {"$in": stale}})
+            print(f"[✓] Removed {result.deleted_count} duplicate metadata record(s)")
+
+
+# openai 和 wikipedia (连带 BeautifulSoup) 导入很慢, 第一次用到时才导入
+_clientLock = threading.Lock()
+_openaiClients = {}
+
+
+def _wikipedia_module():
+    import wikipedia
+    return wikipedia
+
+
+def _openai_client(api_key):
+    # 每个 API key 一个客户端, 复用其连接池
+    with _clientLock:
+        client = _openaiClients.get(api_key)
+        if client is None:
+            from openai import OpenAI
+            client = _openaiClients[api_key] = OpenAI(api_key=api_key)
+        return client
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _truncate(text, limit=None):
+    # 批量请求中每个地标的正文长度上限, 防止超出上下文窗口
+    limit = limit or int(os.getenv("META_LLM_BATCH_CONTENT_CHARS", "6000"))
+    if text and len(text) > limit:
+        return text[:limit] + "..."
+    return text
+
+
+def _parseBatchReply(text, count):
+    """Parse a JSON array reply of {"id": n, ...} objects; every id 1..count must be present."""
+    text = re.sub(r"```(?:json)?", "", text).replace("```", "").strip()
+    replies = json.loads(text)
+    if not isinstance(replies, list):
+        raise ValueError("reply is not a JSON array")
+    by_id = {}
+    for reply in replies:
+        if isinstance(reply, dict) and str(reply.get("id", "")).isdigit():
+            by_id[int(reply["id"])] = reply
+    missing = [i for i in range(1, count + 1) if i not in by_id]
+    if missing:
+        raise ValueError(f"missing ids {missing}")
+    return by_id
 
 
 if __name__ == "__main__":
@@ -1,188 +1,667 @@
 import requests
-from pymongo import MongoClient, GEOSPHERE
+import numpy as np
+from pymongo import UpdateOne
+import itertools
 import json
+import math
 import os
-
-from landmark_meta_generator import LandmarkMetaGenerator
+import time
+
+from array import array
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from overpass_stream import iter_elements, overpass_remark, OverpassError, TeeStream, CHUNK_SIZE
+from overpass_cache import OverpassCache
+from name_index import NameIndex, normalize_name
+from geometry import element_geometry, pack_geometries, compute_geometry_stats, simplify_mask
+from landmark_record import LandmarkRecord
+from snapshot_io import NDJSONWriter, RawWriter, is_ndjson, open_text, iter_chunks, iter_ndjson
+from bulk_writer import bulk_upsert, summarize, BULK_BATCH_SIZE
+from mongo_pool import get_db
+from metrics import external_call, count_bytes, in_context, timed, PAYLOAD_BYTES
 from dotenv import load_dotenv
 
 load_dotenv()
 
+GEOMETRY_BATCH_SIZE = 10000
+TILE_TIMEOUT = int(os.getenv("OVERPASS_TILE_TIMEOUT", "300"))
+
+# 一次刷新最多允许删除 (tombstone) 的比例, 超过则认为 Overpass 结果不完整
+TOMBSTONE_MAX_FRACTION = float(os.getenv("TOMBSTONE_MAX_FRACTION", "0.5"))
+
+# 存储的几何: Douglas-Peucker 容差 (米, 0 为不简化), 坐标小数位数, 顶点格式 points / pairs
+SIMPLIFY_TOLERANCE = float(os.getenv("LANDMARK_SIMPLIFY_TOLERANCE", "1.0"))
+COORD_PRECISION = int(os.getenv("LANDMARK_COORD_PRECISION")) if os.getenv("LANDMARK_COORD_PRECISION") else None
+GEOMETRY_FORMAT = os.getenv("LANDMARK_GEOMETRY_FORMAT", "points").lower()
+
+# 候选地标的 Overpass 过滤条件
+LANDMARK_FILTERS = [
+    'way["amenity"]["name"]["amenity"!="parking"]["amenity"!="parking_space"]["amenity"!="bicycle_parking"]["amenity"!="waste_disposal"]',
+    'way["tourism"]["name"]["tourism"!="guest_house"]',
+    'way["historic"]["name"]',
+    'way["leisure"]["name"]["leisure"!="pitch"]',
+    'way["building"]["name"]',
+]
+
+# 分块查询时替换为 "south,west,north,east" (与 Overpass Turbo 的写法一致)
+BBOX_PLACEHOLDER = "{{bbox}}"
+
+
+def build_landmark_query(city=None, bbox=None, timeout=None, newer=None, ids_only=False, poly=None):
+    """Overpass query for candidate landmarks inside a city's administrative area
+    and/or a bbox (a (south, west, north, east) tuple or BBOX_PLACEHOLDER)
+    and/or a polygon ("lat lon lat lon ..." or a list of (lat, lon) pairs).
+
+    newer: only elements changed since this datetime; ids_only: return type/id only.
+    """
+    settings = "[out:json]" + (f"[timeout:{timeout}]" if timeout else "") + ";"
+    area = f'area["name"="{city}"]["boundary"="administrative"]->.searchArea;' if city else ""
+    scope = "(area.searchArea)" if city else ""
+    if bbox:
+        scope += f"({bbox})" if isinstance(bbox, str) else "({},{},{},{})".format(*bbox)
+    if poly:
+        poly = poly if isinstance(poly, str) else " ".join(f"{lat} {lon}" for lat, lon in poly)
+        scope += f'(poly:"{poly}")'
+    if newer:
+        scope += f'(newer:"{newer.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}")'
+    filters = "\n".join(f"        {f}{scope};" for f in LANDMARK_FILTERS)
+    # meta: 附带 version / timestamp, 用于增量更新
+    out = "out ids;" if ids_only else "out geom meta;"
+    return f"""
+    {settings}
+    {area}
+
+    (
+{filters}
+    );
+    {out}
+    """
+
+
+def incremental_refresh(city, since, margin=None):
+    """Upsert landmarks of ``city`` changed in OSM since ``since`` and tombstone
+    the ones that no longer exist. Returns counts of changed/deleted/live elements."""
+    margin = margin if margin is not None else int(os.getenv("OVERPASS_REFRESH_MARGIN", "3600"))
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # 留出余量, Overpass 数据相对 OSM 主库有延迟
+    since = since - timedelta(seconds=margin)
+
+    processor = LandmarkPreprocessor(build_landmark_query(city, newer=since), city=city, source="area")\
+        .fetchRaw(stream=True, use_cache=False)\
+        .findRawLandmarks(keep_duplicates=True)\
+        .processRawLandmark()
+    changed = len(processor.processedLandmarks)
+    if changed:
+        processor.storeToDB(overwrite=True)
+
+    live = LandmarkPreprocessor(build_landmark_query(city, ids_only=True), city=city, source="area")\
+        .fetchRaw(stream=True, use_cache=False)\
+        .tombstoneMissing()
+    print(f"[✓] Incremental refresh of {city}: {changed} changed, {live['deleted']} deleted")
+    return {"changed": changed, "deleted": live["deleted"], "live": live["live"]}
+
+
+def split_bbox(bbox, rows, cols):
+    south, west, north, east = bbox
+    dlat = (north - south) / rows
+    dlon = (east - west) / cols
+    return [
+        (south + r * dlat, west + c * dlon, south + (r + 1) * dlat, west + (c + 1) * dlon)
+        for r in range(rows) for c in range(cols)
+    ]
+
+
 class LandmarkPreprocessor:
 
-    def __init__(self, query, city="Cork") -> None:
+    def __init__(self, query, city="Cork", cache=None, source=None) -> None:
         self.query = query
         self.city = city
-        self.osmUrl = "https://overpass-api.de/api/interpreter"
+        # 写入文档的 source 字段 (area / bbox / poly / inject), tombstoneMissing 只处理同一来源
+        self.source = source
+        self.cache = cache
+        self.cacheHit = False
+        self.osmUrl = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+        self.db_name = os.getenv("MONGO_DB", "scavengerhunt")
         self.rawFileName = "raw.json"
         self.rawData = None
+        self.rawStream = None
+        self.rawElements = None
         self.rawLandmarks = None
         self.processedLandmarks = None
+        # 所有 LandmarkRecord 共用的顶点缓冲区 (lon, lat 交替)
+        self.coordinates = array("d")
+        self.geometryFormat = GEOMETRY_FORMAT
+        self.writeStats = []
+
+    @classmethod
+    def fromSnapshot(cls, path, city="Cork", query="", source=None):
+        """Preprocessor fed from a saved snapshot instead of Overpass.
+
+        Raw snapshots (``saveRawOSMAsFile`` / batch_ingest ``raw.json.gz``, as
+        ``.json`` or ``.ndjson``) are replayed lazily, exactly like
+        ``fetchRaw(stream=True)``; continue with ``findRawLandmarks()``.
+        Processed NDJSON exports are loaded into ``processedLandmarks``;
+        continue with ``storeToDB()`` / ``saveAsFile()``.
+        """
+        processor = cls(query, city=city, source=source)
+        if not is_ndjson(path):
+            # Overpass 响应体: 未压缩文件 mmap, 逐个解析 elements
+            processor.rawStream = iter_elements(iter_chunks(path))
+            print(f"[✓] Replaying raw snapshot {path}")
+            return processor
+
+        rows = iter_ndjson(path)
+        first = next(rows, None)
+        if first is None or "key" not in first:
+            # 每行一个 Overpass element
+            processor.rawStream = itertools.chain([first] if first else [], rows)
+            print(f"[✓] Replaying raw snapshot {path}")
+            return processor
+
+        # processed 导出: 每行一个地标, 顶点写入共享缓冲区
+        res = {}
+        for row in itertools.chain([first], rows):
+            key = row.pop("key")
+            res[key] = LandmarkRecord.fromPackage(row, processor.coordinates, key)
+        if first.get("geometry") and not isinstance(first["geometry"][0], dict):
+            processor.geometryFormat = "pairs"
+        processor.processedLandmarks = res
+        print(f"[✓] Loaded {len(res)} processed landmarks from {path}")
+        return processor
+
+    def fetchRaw(self, stream=False, use_cache=True, snapshot=None):
+        # stream=True: 不保存完整响应体, elements 在 findRawLandmarks/processRawLandmark 中逐个解析
+        # use_cache=True: 相同查询优先从本地 Overpass 缓存读取
+        # snapshot: (仅流式) 同时把响应体写入该文件, 完整解析且不带 remark 时才生成
+        if snapshot and not stream:
+            raise ValueError("snapshot requires stream=True.")
+        cache = self._cache() if use_cache else None
+        self.rawData = None
+        self.rawStream = None
+        self.rawElements = None
+        self.cacheHit = False
+
+        if cache:
+            if stream:
+                cached = cache.open(self.query)
+                if cached is not None:
+                    chunks = self._readChunks(cached)
+                    self.rawStream = TeeStream(chunks, [lambda: RawWriter(snapshot)]) if snapshot else iter_elements(chunks)
+            else:
+                cached = cache.get(self.query)
+                if cached is not None:
+                    self.rawData = cached.decode("utf-8")
+            self.cacheHit = cached is not None
+            print(f"[Cache] Overpass {'hit' if self.cacheHit else 'miss'}: {cache.key(self.query)[:12]}")
+            if self.cacheHit:
+                return self
+
+        if stream:
+            with external_call("overpass", "interpreter"):
+                res = requests.post(self.osmUrl, data={"data": self.query}, stream=True)
+            # post 在收到响应头后返回; 响应体的下载时间单独记为 overpass.download
+            chunks = count_bytes(res.iter_content(chunk_size=CHUNK_SIZE), "overpass", service="overpass")
+            # 缓存 / 快照文件在开始读取响应体时才创建
+            openers = [lambda: cache.writer(self.query)] if cache and res.status_code == 200 else []
+            if snapshot:
+                openers.append(lambda: RawWriter(snapshot))
+            self.rawStream = TeeStream(chunks, openers) if openers else iter_elements(chunks)
+        else:
+            with external_call("overpass", "interpreter"):
+                res = requests.post(self.osmUrl, data={"data": self.query})
+            PAYLOAD_BYTES.observe(len(res.content), source="overpass")
+            remark = overpass_remark(res.text)
+            if remark:
+                # 超时 / 内存不足的结果不完整, 不缓存也不使用
+                raise OverpassError(f"Incomplete Overpass result: {remark}")
+            self.rawData = res.text
+            if cache and res.status_code == 200:
+                cache.put(self.query, res.content)
+        return self
 
-    def fetchRaw(self):
-        res = requests.post(self.osmUrl, data={"data": self.query})
-        self.rawData = res.text
+    @timed("preprocessor.fetchTiled", lambda self: len(self.rawElements))
+    def fetchTiled(self, bbox, rows=None, cols=None, tile_size=None, workers=None, retries=3, use_cache=True):
+        """Fetch ``self.query`` (containing BBOX_PLACEHOLDER) tile by tile over
+        bbox = (south, west, north, east) and merge the elements by OSM id."""
+        if BBOX_PLACEHOLDER not in self.query:
+            raise ValueError(f"Tiled fetch needs a query containing {BBOX_PLACEHOLDER}.")
+
+        if not rows or not cols:
+            tile_size = tile_size or float(os.getenv("OVERPASS_TILE_SIZE", "0.05"))
+            rows = max(1, math.ceil((bbox[2] - bbox[0]) / tile_size))
+            cols = max(1, math.ceil((bbox[3] - bbox[1]) / tile_size))
+        tiles = split_bbox(bbox, rows, cols)
+        workers = workers or int(os.getenv("OVERPASS_TILE_WORKERS", "2"))
+        cache = self._cache() if use_cache else None
+        print(f"[*] Fetching {len(tiles)} tiles ({rows}x{cols}) with {workers} workers...")
+
+        merged = {}
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(in_context(self._fetchTile), tile, cache, retries): tile for tile in tiles}
+            for future in as_completed(futures):
+                try:
+                    elements = future.result()
+                except Exception as e:
+                    print(f"[x] Tile {futures[future]} failed: {e}")
+                    failed.append(futures[future])
+                    continue
+                # 跨越分块边界的 way 会被多个分块返回
+                for entry in elements:
+                    merged[(entry.get("type"), entry.get("id"))] = entry
+
+        if failed:
+            # 成功的分块已进入缓存, 重跑时只会重新请求失败的分块
+            raise RuntimeError(f"{len(failed)}/{len(tiles)} Overpass tiles failed: {failed}")
+
+        print(f"[✓] Merged {len(merged)} unique elements from {len(tiles)} tiles")
+        self.rawData = None
+        self.rawStream = None
+        self.rawElements = list(merged.values())
         return self
 
-    def findRawLandmarks(self, landmarks=None):
-        if self.rawData:
-            rawData = json.loads(self.rawData)
+    def _fetchTile(self, tile, cache, retries):
+        query = self.query.replace(BBOX_PLACEHOLDER, ",".join(f"{v:.6f}" for v in tile))
+        if cache:
+            cached = cache.get(query)
+            if cached is not None:
+                return json.loads(cached)["elements"]
+
+        for attempt in range(retries + 1):
+            try:
+                with external_call("overpass", "tile"):
+                    res = requests.post(self.osmUrl, data={"data": query}, timeout=TILE_TIMEOUT)
+                    res.raise_for_status()
+                PAYLOAD_BYTES.observe(len(res.content), source="overpass_tile")
+                body = res.json()
+                if body.get("remark"):
+                    raise OverpassError(f"Incomplete Overpass result: {body['remark']}")
+                elements = body["elements"]
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = 2 ** attempt
+                print(f"[!] Tile {tile} attempt {attempt + 1} failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+                continue
+            if cache:
+                cache.put(query, res.content)
+            return elements
+
+    def _cache(self):
+        if self.cache is None:
+            self.cache = OverpassCache()
+        return self.cache
+
+    @staticmethod
+    def _readChunks(f):
+        with f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                yield chunk
+
+    @timed("preprocessor.findRawLandmarks")
+    def findRawLandmarks(self, landmarks=None, keep_duplicates=False):
+        # keep_duplicates=True: 同名的多个 OSM 元素全部保留, 键改为 "type/id"
+        if self.rawStream is not None:
+            # 流式模式: 惰性过滤, 由 processRawLandmark 消费
+            self.rawLandmarks = self._iterRawLandmarks(self.rawStream, landmarks, keep_duplicates)
+            self.rawStream = None
+            return self
+
+        if self.rawElements is not None:
+            elements = self.rawElements
+        elif self.rawData:
+            elements = json.loads(self.rawData)["elements"]
         else:
             raise ValueError("No raw data. Please run fetchRaw() first.")
 
+        index = NameIndex(elements)
         res = {}
         if not landmarks:
-            for entry in rawData["elements"]:
-                info = entry.get("tags", None)
-                if info and "name" in info:
-                    res[info["name"]] = entry
+            for name, entries in index.exact.items():
+                if keep_duplicates:
+                    res.update((self._osmKey(entry), entry) for entry in entries)
+                else:
+                    res[name] = entries[-1]
         else:
             for landmark in landmarks:
-                for entry in rawData["elements"]:
-                    info = entry.get("tags", None)
-                    if info and "name" in info and info["name"] == landmark:
-                        res[landmark] = entry
-                        break
-                else:
+                entries = index.find(landmark)
+                if not entries:
                     print(f"[Warn] {landmark} Not Found!")
+                elif keep_duplicates:
+                    res.update((self._osmKey(entry), entry) for entry in entries)
+                else:
+                    res[landmark] = entries[0]
 
         self.rawLandmarks = res
         return self
 
-    def processRawLandmark(self):
+    @staticmethod
+    def _osmKey(entry):
+        return f"{entry.get('type', 'way')}/{entry.get('id')}"
+
+    def _iterRawLandmarks(self, elements, landmarks=None, keep_duplicates=False):
+        if not landmarks:
+            for entry in elements:
+                info = entry.get("tags", None)
+                if info and "name" in info:
+                    yield (self._osmKey(entry) if keep_duplicates else info["name"]), entry
+            return
+
+        # 单次遍历 elements: 精确匹配直接输出, 归一化匹配先暂存, 最后补给没有精确匹配的名称
+        pending = set(landmarks)
+        byNormalized = {}
+        for landmark in landmarks:
+            byNormalized.setdefault(normalize_name(landmark), []).append(landmark)
+        candidates = {}
+
+        for entry in elements:
+            if not pending and not keep_duplicates:
+                # 提前结束: 剩余响应体不解析, 直接写入缓存 / 快照
+                if isinstance(elements, TeeStream):
+                    elements.finish()
+                break
+            info = entry.get("tags", None)
+            if not info or "name" not in info:
+                continue
+            name = info["name"]
+            matches = byNormalized.get(normalize_name(name), ())
+            if name in pending or (keep_duplicates and name in matches):
+                pending.discard(name)
+                yield (self._osmKey(entry) if keep_duplicates else name), entry
+                if keep_duplicates:
+                    continue
+            # 已精确匹配的元素也可能是其他名称的归一化候选 (与 NameIndex.find 的结果一致)
+            for landmark in matches:
+                if landmark in pending:
+                    candidates.setdefault(landmark, []).append(entry)
+
+        for landmark in landmarks:
+            if landmark not in pending:
+                continue
+            entries = candidates.get(landmark)
+            if not entries:
+                print(f"[Warn] {landmark} Not Found!")
+            elif keep_duplicates:
+                for entry in entries:
+                    yield self._osmKey(entry), entry
+            else:
+                yield landmark, entries[0]
+
+    @timed("preprocessor.processRawLandmark", lambda self: len(self.processedLandmarks))
+    def processRawLandmark(self, batch_size=GEOMETRY_BATCH_SIZE, tolerance=None, precision=None, geometry_format=None,
+                           export=None):
+        """Compute centroid/bbox/area/perimeter from the full geometry, then keep a
+        simplified copy (``tolerance`` metres) as LandmarkRecords; ``geometry_format``
+        (points / pairs) applies when they are exported.
+
+        ``export``: NDJSON file name under outputfiles/ (``.gz`` / ``.zst`` to
+        compress) that receives each batch as soon as it is processed.
+        """
+        options = {
+            "tolerance": SIMPLIFY_TOLERANCE if tolerance is None else tolerance,
+            "precision": COORD_PRECISION if precision is None else precision,
+        }
+        self.geometryFormat = (geometry_format or GEOMETRY_FORMAT).lower()
         if not self.rawLandmarks:
             raise ValueError("No raw landmarks. Please run findRawLandmarks() first.")
 
-        res = {}
-        for name, info in self.rawLandmarks.items():
-            package = {}
-
-            # centroids
-            centroid_lat = sum(pt["lat"] for pt in info["geometry"]) / len(info["geometry"])
-            centroid_lon = sum(pt["lon"] for pt in info["geometry"]) / len(info["geometry"])
+        rawLandmarks = self.rawLandmarks
+        if isinstance(rawLandmarks, dict):
+            rawLandmarks = rawLandmarks.items()
 
-            package["latitude"] = centroid_lat
-            package["longitude"] = centroid_lon
-
-            # Keep all geometry points
-            geometry_points = []
-            for pt in info["geometry"]:
-                geometry_points.append({
-                    "lat": pt["lat"],
-                    "lon": pt["lon"]
-                })
+        # 按批次打包坐标, 每批一次性向量化计算几何信息 (流式模式下内存也保持有界)
+        self.coordinates = array("d")
+        writer = NDJSONWriter(self._outputPath(export)) if export else None
+        res = {}
+        batch = []
+        try:
+            for name, info in rawLandmarks:
+                geometry = element_geometry(info)
+                if not geometry:
+                    print(f"[Warn] {name} has no geometry, skipped.")
+                    continue
+                batch.append((name, info, geometry))
+                if len(batch) >= batch_size:
+                    self._processBatch(batch, res, writer=writer, **options)
+                    batch = []
+            if batch:
+                self._processBatch(batch, res, writer=writer, **options)
+        except BaseException:
+            if writer:
+                writer.abort()
+            raise
+        if writer:
+            writer.commit()
+            print(f"[✓] {writer.count} processed landmarks exported to {writer.path}")
+
+        # 原始元素已全部转换, 释放 (rawData 保留给 saveRawOSMAsFile)
+        self.rawLandmarks = None
+        self.rawElements = None
+        self.processedLandmarks = res
+        return self
 
-            package["geometry"] = geometry_points
+    def _processBatch(self, batch, res, tolerance=0, precision=None, writer=None):
+        lat, lon, offsets = pack_geometries([geometry for _, _, geometry in batch])
+        stats = {field: values.tolist() for field, values in compute_geometry_stats(lat, lon, offsets).items()}
 
-            info["tags"].pop("name", None)
-            package["tags"] = info["tags"]
-            res[name] = package
+        keep = simplify_mask(lat, lon, offsets, tolerance)
+        interleaved = np.column_stack((lon[keep], lat[keep])).astype(np.float64)
 
-        self.processedLandmarks = res
-        return self
+        # 保留的顶点追加到共享缓冲区, 每个地标只记录起点和数量
+        base = len(self.coordinates) // 2
+        if precision is None:
+            self.coordinates.frombytes(interleaved.tobytes())
+        else:
+            # 与内置 round 保持一致 (np.round 的舍入结果在个别坐标上不同)
+            self.coordinates.extend(round(value, precision) for value in interleaved.ravel().tolist())
+        counts = np.diff(offsets).tolist()
+        kept = np.add.reduceat(keep, offsets[:-1]).tolist() if len(keep) else []
+        starts = (base + np.concatenate(([0], np.cumsum(kept)[:-1]))).tolist() if kept else []
+
+        for i, (key, info, _) in enumerate(batch):
+            tags = info.get("tags", {})
+            res[key] = LandmarkRecord(
+                tags.pop("name", key), info.get("type"), info.get("id"), info.get("version"), info.get("timestamp"),
+                stats["latitude"][i], stats["longitude"][i],
+                stats["minLat"][i], stats["minLon"][i], stats["maxLat"][i], stats["maxLon"][i],
+                stats["area"][i], stats["perimeter"][i], counts[i],
+                self.coordinates, int(starts[i]), kept[i], tags,
+            )
+            if writer:
+                writer.write(self._exportLine(key, res[key]))
+
+    @timed("preprocessor.storeToDB", lambda self: len(self.processedLandmarks))
+    def storeToDB(self, collection_name="landmarks", overwrite=False, db_name=None):
+        if not self.processedLandmarks:
+            raise ValueError("No processed landmarks to store. Run processRawLandmark() first.")
 
-    def storeToDB(self, collection_name="landmark_metadata", overwrite=False):
-        client = MongoClient(self.mongo_url)
-        db = client[self.db_name]
+        db = get_db(db_name or self.db_name)
         collection = db[collection_name]
 
-        # 为landmarkId创建唯一索引
         try:
-            collection.create_index("landmarkId", unique=True)
-        except Exception:
-            # 如果已有重复数据，索引创建会失败，需要先清理
-            print("[!] Unique index creation failed, cleaning duplicates first...")
-            pass
-
-        inserted_count = 0
-        skipped_count = 0
-        cleaned_count = 0
-
-        for lm_id, info in self.metaInfo.items():
-            entry = {
-                "landmarkId": lm_id,
-                "name": info["name"],
-                "city": info.get("city", ""),
-                "meta": info.get("meta", {})
-            }
-
-            # 查找所有匹配的记录
-            existing_docs = list(collection.find({"landmarkId": lm_id}))
-            
-            if existing_docs:
-                if overwrite:
-                    # 如果要覆盖，删除所有旧记录，插入新的
-                    result = collection.delete_many({"landmarkId": lm_id})
-                    cleaned_count += result.deleted_count
-                    
-                    collection.insert_one(entry)
-                    inserted_count += 1
-                    print(f"[✓] Replaced {result.deleted_count} old record(s) for: {info['name']}")
-                else:
-                    # 不覆盖的情况下，检查是否有完整的 description
-                    has_complete_data = any(
-                        doc.get("meta", {}).get("description") 
-                        for doc in existing_docs
-                    )
-                    
-                    if has_complete_data:
-                        # 已有完整数据，跳过
-                        skipped_count += 1
-                        print(f"[→] Skipped (complete data exists): {info['name']}")
-                    else:
-                        # 已有数据不完整，删除并插入新的
-                        result = collection.delete_many({"landmarkId": lm_id})
-                        cleaned_count += result.deleted_count
-                        
-                        collection.insert_one(entry)
-                        inserted_count += 1
-                        print(f"[✓] Replaced {result.deleted_count} incomplete record(s) for: {info['name']}")
+            collection.create_index([("city", 1), ("name", 1)])
+            collection.create_index([("osmType", 1), ("osmId", 1)], sparse=True)
+        except Exception as e:
+            print(f"[!] Could not create landmark index: {e}")
+
+        # overwrite=True: 更新几何和标签, 保留 _id 和 riddle
+        # overwrite=False: 只插入数据库中还没有的地标
+        operations = []
+        for key, record in self.processedLandmarks.items():
+            doc = self.toDocument(key, record)
+            if doc["osmId"] is not None:
+                # 按 OSM id 匹配; 没有 osmId 的旧记录按名称匹配并补上 id
+                selector = {"city": doc["city"], "$or": [
+                    {"osmType": doc["osmType"], "osmId": doc["osmId"]},
+                    {"name": doc["name"], "osmId": {"$exists": False}}
+                ]}
+            else:
+                selector = {"name": doc["name"], "city": doc["city"]}
+
+            if overwrite:
+                riddle = doc.pop("riddle")
+                update = {"$set": doc, "$setOnInsert": {"riddle": riddle}, "$unset": {"deleted": "", "deletedAt": ""}}
+            elif doc["osmId"] is not None:
+                identity = {"osmType": doc.pop("osmType"), "osmId": doc.pop("osmId")}
+                update = {"$setOnInsert": doc, "$set": identity}
             else:
-                # 不存在则插入新记录
-                collection.insert_one(entry)
-                inserted_count += 1
-                print(f"[✓] Inserted: {info['name']}")
+                update = {"$setOnInsert": doc}
+            operations.append(UpdateOne(selector, update, upsert=True))
+
+        self.writeStats = bulk_upsert(collection, operations)
+        total = summarize(self.writeStats)
 
         print(f"\n[Summary] Collection: {collection_name}")
-        print(f"  - Inserted: {inserted_count}")
-        print(f"  - Skipped: {skipped_count}")
-        print(f"  - Old Records Cleaned: {cleaned_count}")
-        
-        # 清理完后，确保创建唯一索引
-        try:
-            collection.create_index("landmarkId", unique=True)
-            print(f"[✓] Unique index ensured on landmarkId")
-        except Exception as e:
-            print(f"[!] Could not create unique index: {e}")
+        print(f"  - Batches: {total['batches']}")
+        print(f"  - Inserted: {total['inserted']}")
+        print(f"  - Updated: {total['updated']}")
+        print(f"  - Skipped: {total['skipped']}")
+        print(f"  - Failed: {total['failed']}")
+        return self
+
+    def toDocument(self, key, record):
+        # landmarks 集合的标准格式: centroid 对象 + GeoJSON 几何
+        coordinates = record.coordinates()
+        if len(coordinates) >= 3:
+            # 闭合多边形
+            if coordinates[0] != coordinates[-1]:
+                coordinates.append(coordinates[0])
+            geometry = {"type": "Polygon", "coordinates": [coordinates]}
+        elif len(coordinates) == 2:
+            geometry = {"type": "LineString", "coordinates": coordinates}
+        else:
+            geometry = {"type": "Point", "coordinates": coordinates[0]}
+
+        return {
+            "name": record.name or key,
+            "city": self.city,
+            "centroid": {
+                "latitude": record.latitude,
+                "longitude": record.longitude
+            },
+            "geometry": geometry,
+            "bbox": record.bbox(),
+            "area": record.area,
+            "perimeter": record.perimeter,
+            "compression": record.compression(),
+            "tags": record.tags,
+            "osmType": record.osmType,
+            "osmId": record.osmId,
+            "osmVersion": record.osmVersion,
+            "osmTimestamp": record.osmTimestamp,
+            "source": self.source,
+            "riddle": None
+        }
+
+    @timed("preprocessor.tombstoneMissing")
+    def tombstoneMissing(self, collection_name="landmarks", db_name=None, max_fraction=None):
+        """Mark stored landmarks of this city and ``source`` whose OSM element is no
+        longer in the fetched result (normally an ``out ids`` query) as deleted.
+
+        Raises instead of deleting when the result carries an Overpass ``remark``
+        or would tombstone more than ``max_fraction`` of the stored landmarks.
+        """
+        if not self.source:
+            raise ValueError("tombstoneMissing needs the source of the query (e.g. source=\"area\").")
+        max_fraction = TOMBSTONE_MAX_FRACTION if max_fraction is None else max_fraction
+        if self.rawStream is not None:
+            elements = self.rawStream
+            self.rawStream = None
+        elif self.rawElements is not None:
+            elements = self.rawElements
+        elif self.rawData:
+            body = json.loads(self.rawData)
+            if body.get("remark"):
+                raise OverpassError(f"Incomplete Overpass result: {body['remark']}")
+            elements = body["elements"]
+        else:
+            raise ValueError("No raw data. Please run fetchRaw() first.")
+        # 流式结果带 remark 时在这里抛出 OverpassError
+        live = {(entry.get("type"), entry.get("id")) for entry in elements}
+
+        # 只处理由同一查询导入的地标; inject_way / 局部范围导入的地标不在此查询结果中
+        collection = get_db(db_name or self.db_name)[collection_name]
+        stored = list(collection.find(
+            {"city": self.city, "source": self.source, "osmId": {"$ne": None}, "deleted": {"$ne": True}},
+            {"_id": 1, "osmType": 1, "osmId": 1}
+        ))
+        stale = [doc["_id"] for doc in stored if (doc.get("osmType"), doc["osmId"]) not in live]
+        if stale and len(stale) > max_fraction * len(stored):
+            raise RuntimeError(
+                f"Refusing to tombstone {len(stale)}/{len(stored)} landmarks of {self.city} "
+                f"({len(live)} live elements); the Overpass result looks incomplete."
+            )
+
+        deleted = 0
+        now = datetime.now(timezone.utc)
+        for i in range(0, len(stale), BULK_BATCH_SIZE):
+            result = collection.update_many(
+                {"_id": {"$in": stale[i:i + BULK_BATCH_SIZE]}},
+                {"$set": {"deleted": True, "deletedAt": now}}
+            )
+            deleted += result.modified_count
+        return {"live": len(live), "deleted": deleted}
+
+    @staticmethod
+    def _outputPath(filename):
+        os.makedirs("outputfiles", exist_ok=True)
+        return os.path.join("outputfiles", filename)
+
+    def _exportLine(self, key, record):
+        # NDJSON 每行一个地标, "key" 为 processedLandmarks 中的键
+        return {"key": key, **record.toPackage(self.geometryFormat == "pairs")}
 
     def saveAsFile(self, filename="processed.json"):
+        """``.json`` keeps the single indented document; ``.ndjson`` / ``.jsonl``
+        writes one landmark per line. Add ``.gz`` or ``.zst`` to compress."""
         if not self.processedLandmarks:
             raise ValueError("No processed landmarks to save. Run processRawLandmark() first.")
 
-        os.makedirs("outputfiles", exist_ok=True)
-        path = os.path.join("outputfiles", filename)
-
-        with open(path, 'w', encoding='utf-8') as f:  # 添加 encoding='utf-8'
-            json.dump(self.processedLandmarks, f, indent=2, ensure_ascii=False)  # 添加 ensure_ascii=False
+        path = self._outputPath(filename)
+        if is_ndjson(path):
+            with NDJSONWriter(path) as writer:
+                for key, record in self.processedLandmarks.items():
+                    writer.write(self._exportLine(key, record))
+        else:
+            with open_text(path, "w") as f:
+                pairs = self.geometryFormat == "pairs"
+                packages = {key: record.toPackage(pairs) for key, record in self.processedLandmarks.items()}
+                json.dump(packages, f, indent=2, ensure_ascii=False)  # 添加 ensure_ascii=False
 
         print(f"Processed landmarks saved to {path}")
         return self
 
     def saveRawOSMAsFile(self, filename="raw.json"):
-        if not self.rawData:
-            raise ValueError("No raw OSM data. Run fetchRaw() first.")
-
-        os.makedirs("outputfiles", exist_ok=True)
-        path = os.path.join("outputfiles", filename)
-
-        with open(path, 'w') as f:
-            f.write(self.rawData)
+        """``.json`` writes the Overpass response as received; ``.ndjson`` / ``.jsonl``
+        writes one element per line. Add ``.gz`` or ``.zst`` to compress."""
+        path = self._outputPath(filename)
+        if is_ndjson(path):
+            if self.rawElements is not None:
+                elements = self.rawElements
+            elif self.rawData:
+                # 逐个解析 elements, 不构建完整文档
+                elements = iter_elements(self.rawData[i:i + CHUNK_SIZE] for i in range(0, len(self.rawData), CHUNK_SIZE))
+            else:
+                raise ValueError("No raw OSM data. Run fetchRaw() first.")
+            with NDJSONWriter(path) as writer:
+                writer.writeMany(elements)
+        else:
+            if not self.rawData:
+                raise ValueError("No raw OSM data. Run fetchRaw() first.")
+            with open_text(path, "w") as f:
+                for i in range(0, len(self.rawData), CHUNK_SIZE):
+                    f.write(self.rawData[i:i + CHUNK_SIZE])
 
         print(f"[✓] Raw OSM data saved to {path}")
         return self
 
 
 if __name__ == "__main__":
+    from landmark_meta_generator import LandmarkMetaGenerator
+
     query = """
     [out:json];
     area["name"="Cork"]["boundary"="administrative"]->.searchArea;
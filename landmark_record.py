@@ -0,0 +1,118 @@
+from array import array
+
+
+class LandmarkRecord:
+    """One processed landmark.
+
+    Vertices are not stored per record: ``coords`` is an ``array('d')`` shared
+    by all records of a LandmarkPreprocessor, holding interleaved lon, lat
+    values; this record's vertices are pairs ``start .. start + count``.
+    ``toPackage`` gives the dict shape used by JSON exports.
+    """
+
+    __slots__ = (
+        "name", "osmType", "osmId", "osmVersion", "osmTimestamp",
+        "latitude", "longitude", "minLat", "minLon", "maxLat", "maxLon",
+        "area", "perimeter", "sourceVertices", "coords", "start", "count", "tags",
+    )
+
+    def __init__(self, name, osmType, osmId, osmVersion, osmTimestamp, latitude, longitude,
+                 minLat, minLon, maxLat, maxLon, area, perimeter, sourceVertices, coords, start, count, tags):
+        self.name = name
+        self.osmType = osmType
+        self.osmId = osmId
+        self.osmVersion = osmVersion
+        self.osmTimestamp = osmTimestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.minLat = minLat
+        self.minLon = minLon
+        self.maxLat = maxLat
+        self.maxLon = maxLon
+        self.area = area
+        self.perimeter = perimeter
+        self.sourceVertices = sourceVertices
+        self.coords = coords
+        self.start = start
+        self.count = count
+        self.tags = tags
+
+    def coordinates(self):
+        """Stored vertices as GeoJSON-ordered [lon, lat] pairs."""
+        flat = self.coords[2 * self.start:2 * (self.start + self.count)].tolist()
+        return [flat[i:i + 2] for i in range(0, len(flat), 2)]
+
+    def vertices(self, pairs=False):
+        if pairs:
+            return self.coordinates()
+        flat = self.coords[2 * self.start:2 * (self.start + self.count)].tolist()
+        return [{"lat": flat[i + 1], "lon": flat[i]} for i in range(0, len(flat), 2)]
+
+    def bbox(self):
+        return {"minLat": self.minLat, "minLon": self.minLon, "maxLat": self.maxLat, "maxLon": self.maxLon}
+
+    def compression(self):
+        return {
+            "sourceVertices": self.sourceVertices,
+            "storedVertices": self.count,
+            "ratio": round(self.sourceVertices / self.count, 2) if self.count else 1.0,
+        }
+
+    def toPackage(self, pairs=False):
+        return {
+            "name": self.name,
+            "osmType": self.osmType,
+            "osmId": self.osmId,
+            "osmVersion": self.osmVersion,
+            "osmTimestamp": self.osmTimestamp,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "bbox": self.bbox(),
+            "area": self.area,
+            "perimeter": self.perimeter,
+            "geometry": self.vertices(pairs),
+            "compression": self.compression(),
+            "tags": self.tags,
+        }
+
+    @classmethod
+    def fromPackage(cls, package, coords=None, key=None):
+        """Rebuild a record from ``toPackage`` output, appending its vertices to ``coords``."""
+        coords = coords if coords is not None else array("d")
+        start = len(coords) // 2
+        for pt in package.get("geometry") or []:
+            if isinstance(pt, dict):
+                coords.append(pt["lon"])
+                coords.append(pt["lat"])
+            else:
+                coords.extend(pt[:2])
+        bbox = package.get("bbox") or {}
+        count = len(coords) // 2 - start
+        return cls(
+            package.get("name", key), package.get("osmType"), package.get("osmId"),
+            package.get("osmVersion"), package.get("osmTimestamp"),
+            package["latitude"], package["longitude"],
+            bbox.get("minLat", package["latitude"]), bbox.get("minLon", package["longitude"]),
+            bbox.get("maxLat", package["latitude"]), bbox.get("maxLon", package["longitude"]),
+            package.get("area"), package.get("perimeter"),
+            (package.get("compression") or {}).get("sourceVertices", count),
+            coords, start, count, package.get("tags") or {},
+        )
+
+    # 兼容原来的 dict 访问方式: record["osmId"], record.get("tags")
+    def __getitem__(self, field):
+        if field == "bbox":
+            return self.bbox()
+        if field == "geometry":
+            return self.vertices()
+        if field == "compression":
+            return self.compression()
+        if field in self.__slots__:
+            return getattr(self, field)
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
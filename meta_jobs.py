@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+
+from mongo_pool import get_db
+
+load_dotenv()
+
+JOBS_COLLECTION = "meta_jobs"
+CLAIMS_COLLECTION = "meta_job_claims"
+
+
+class MetaJobQueue:
+    """Background metadata generation for /generate-landmark-meta.
+
+    Jobs live in the ``meta_jobs`` collection, so any worker process can
+    report their status. The landmarks of a job run in chunks of
+    ``chunk_size`` on this process's bounded thread pool. Each chunk goes
+    through one LandmarkMetaGenerator, so META_WORKERS and
+    META_LLM_BATCH_SIZE apply within it. A landmark that is already queued or
+    running in another job (in any worker) holds a claim in
+    ``meta_job_claims`` and is merged into that job instead of being
+    generated twice. Claims of a worker that died expire after
+    ``claim_ttl`` seconds.
+    """
+
+    def __init__(self, workers=None, history=None, chunk_size=None, claim_ttl=None):
+        self.workers = workers or int(os.getenv("META_JOB_WORKERS", "2"))
+        self.history = history or int(os.getenv("META_JOB_HISTORY", "200"))
+        self.chunk_size = chunk_size or int(os.getenv("META_JOB_CHUNK_SIZE", "20"))
+        self.claim_ttl = claim_ttl or int(os.getenv("META_JOB_CLAIM_TTL", "3600"))
+        self._llmCache = None
+        self._llmCacheLock = threading.Lock()
+        self._indexed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="meta-job")
+
+    def submit(self, landmark_ids):
+        """Queue landmark_ids; returns (job or None, {landmarkId: jobId} merged into existing jobs)."""
+        jobs, claims = self._collections()
+        job_id = uuid.uuid4().hex
+        # 先写入任务, 其他 worker 看到认领记录时任务已可查询
+        jobs.insert_one({
+            "_id": job_id,
+            "status": "queued",
+            "total": 0,
+            "generated": 0,
+            "skipped": 0,
+            "failed": 0,
+            "items": [],
+            "createdAt": time.time(),
+            "finishedAt": None,
+        })
+
+        merged = {}
+        new_ids = []
+        for lm_id in dict.fromkeys(landmark_ids):
+            claim = claims.find_one_and_update(
+                {"landmarkId": lm_id},
+                {"$setOnInsert": {"jobId": job_id, "claimedAt": datetime.now(timezone.utc)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            if claim["jobId"] == job_id:
+                new_ids.append(lm_id)
+            else:
+                merged[lm_id] = claim["jobId"]
+
+        if not new_ids:
+            jobs.delete_one({"_id": job_id})
+            return None, merged
+
+        job = jobs.find_one_and_update(
+            {"_id": job_id},
+            {"$set": {"total": len(new_ids), "items": [{"landmarkId": lm_id, "state": "queued"} for lm_id in new_ids]}},
+            return_document=ReturnDocument.AFTER
+        )
+        self._trimHistory(jobs)
+
+        for start in range(0, len(new_ids), self.chunk_size):
+            self._executor.submit(self._runChunk, job_id, new_ids[start:start + self.chunk_size])
+        return self._view(job), merged
+
+    def status(self, job_id):
+        jobs, _ = self._collections()
+        job = jobs.find_one({"_id": job_id})
+        return self._view(job) if job else None
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def llmCache(self):
+        """The LLMCache shared by every job of this process (and by synchronous generation in app.py)."""
+        with self._llmCacheLock:
+            if self._llmCache is None:
+                from llm_cache import LLMCache
+                self._llmCache = LLMCache()
+            return self._llmCache
+
+    def warmUp(self):
+        """Open the LLM cache and create the job collection indexes before the first request."""
+        self.llmCache()
+        self._collections()
+        return self
+
+    def _runChunk(self, job_id, ids):
+        self._mark(job_id, {lm_id: "running" for lm_id in ids})
+        outcomes = {}
+        try:
+            from landmark_meta_generator import LandmarkMetaGenerator
+            generator = LandmarkMetaGenerator("openai", llm_cache=self.llmCache()).loadLandmarksFromDB(ids)
+            found = {lm_id for lm_id, _, _ in generator.landmarks}
+            for lm_id in ids:
+                if lm_id not in found:
+                    outcomes[lm_id] = "failed: Landmark not found"
+            if found:
+                generator.fetchWiki().fetchOpenAI().storeToDB(collection_name="landmark_metadata", overwrite=False)
+
+                # storeToDB 按 metaInfo 的顺序写入, 写入错误的位置对应 metaInfo 中的地标
+                written = list(generator.metaInfo)
+                failed = {written[op] for stats in generator.writeStats for op in stats["failedOps"]}
+                skipped = {written[op] for stats in generator.writeStats for op in stats["skippedOps"]}
+                for lm_id in written:
+                    if lm_id in failed:
+                        outcomes[lm_id] = "failed: Write failed"
+                    elif lm_id in skipped:
+                        outcomes[lm_id] = "skipped"
+                    else:
+                        outcomes[lm_id] = "generated"
+        except Exception as e:
+            print(f"[Meta Job] {job_id} chunk of {len(ids)} landmarks failed: {e}")
+            for lm_id in ids:
+                outcomes.setdefault(lm_id, f"failed: {e}")
+        # 没有出现在 metaInfo 中的地标 (例如生成阶段被丢弃) 记为失败
+        for lm_id in ids:
+            outcomes.setdefault(lm_id, "failed: No metadata generated")
+        self._finish(job_id, outcomes)
+
+    def _mark(self, job_id, states, inc=None):
+        """Set items[*].state for each landmarkId in ``states``, in one update."""
+        jobs, _ = self._collections()
+        by_state = {}
+        for lm_id, state in states.items():
+            by_state.setdefault(state, []).append(lm_id)
+        update = {"$set": {f"items.$[s{i}].state": state for i, state in enumerate(by_state)}}
+        if inc:
+            update["$inc"] = inc
+        else:
+            update["$set"]["status"] = "running"
+        return jobs.find_one_and_update(
+            {"_id": job_id},
+            update,
+            array_filters=[{f"s{i}.landmarkId": {"$in": ids}} for i, ids in enumerate(by_state.values())],
+            projection={"items": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _finish(self, job_id, outcomes):
+        jobs, claims = self._collections()
+        inc = {"generated": 0, "skipped": 0, "failed": 0}
+        for state in outcomes.values():
+            inc[state.split(":", 1)[0]] += 1
+        job = self._mark(job_id, outcomes, inc={k: v for k, v in inc.items() if v})
+        claims.delete_many({"landmarkId": {"$in": list(outcomes)}, "jobId": job_id})
+        if job and job["generated"] + job["skipped"] + job["failed"] >= job["total"]:
+            jobs.update_one({"_id": job_id, "status": {"$ne": "done"}},
+                            {"$set": {"status": "done", "finishedAt": time.time()}})
+
+    def _trimHistory(self, jobs):
+        # 只淘汰已完成的任务
+        excess = jobs.count_documents({}) - self.history
+        if excess <= 0:
+            return
+        finished = [job["_id"] for job in jobs.find({"status": "done"}, {"_id": 1}).sort("createdAt", ASCENDING).limit(excess)]
+        if finished:
+            jobs.delete_many({"_id": {"$in": finished}})
+
+    def _collections(self):
+        db = get_db()
+        jobs, claims = db[JOBS_COLLECTION], db[CLAIMS_COLLECTION]
+        if not self._indexed:
+            try:
+                claims.create_index("landmarkId", unique=True)
+                claims.create_index("claimedAt", expireAfterSeconds=self.claim_ttl)
+                jobs.create_index("createdAt")
+                self._indexed = True
+            except Exception as e:
+                print(f"[!] Could not create indexes on {CLAIMS_COLLECTION}: {e}")
+        return jobs, claims
+
+    @staticmethod
+    def _view(job):
+        view = {"jobId": job["_id"]}
+        view.update((key, value) for key, value in job.items() if key not in ("_id", "items"))
+        view["items"] = {item["landmarkId"]: item["state"] for item in job.get("items", [])}
+        view["processed"] = view["generated"] + view["skipped"] + view["failed"]
+        return view
@@ -0,0 +1,354 @@
+import atexit
+import contextvars
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import bson
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+load_dotenv()
+
+# 当前请求的 ID 和阶段耗时, 由 app.py 在每个请求开始时设置
+request_id_var = contextvars.ContextVar("request_id", default=None)
+request_timings_var = contextvars.ContextVar("request_timings", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1KB ... 1GB
+
+# 多进程 (gunicorn 多 worker) 时, 每个进程定期把自己的累计值写入该目录, /metrics 合并所有进程的文件
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _labelText(self, key, extra=None):
+        pairs = list(zip(self.labels, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._renderValues(sorted((self.snapshot() if values is None else values).items()))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _merge(a, b):
+        return a + b
+
+    def _renderValues(self, items):
+        return [f"{self.name}{self._labelText(key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def _merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _renderValues(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self._labelText(key, ('le', f'{bound:g}'))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{self._labelText(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{self._labelText(key)} {total}")
+            lines.append(f"{self.name}_count{self._labelText(key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("landmark_stage_duration_seconds", "Pipeline stage duration.", ["stage"])
+STAGE_ITEMS = Counter("landmark_stage_items_total", "Items produced by pipeline stages.", ["stage"])
+STAGE_ERRORS = Counter("landmark_stage_errors_total", "Pipeline stages that raised.", ["stage"])
+EXTERNAL_SECONDS = Histogram("landmark_external_call_duration_seconds", "Outbound call latency.", ["service", "operation"])
+EXTERNAL_CALLS = Counter("landmark_external_calls_total", "Outbound calls by result.", ["service", "operation", "status"])
+PAYLOAD_BYTES = Histogram("landmark_payload_bytes", "Size of fetched payloads.", ["source"], buckets=SIZE_BUCKETS)
+HTTP_SECONDS = Histogram("landmark_http_request_duration_seconds", "HTTP request latency.", ["endpoint", "method", "status"])
+
+
+def render():
+    """All metrics in the Prometheus text exposition format.
+
+    With METRICS_MULTIPROC_DIR set, the values of every process that wrote a
+    snapshot there (including exited workers, so counters never go back) are
+    added to this process's own.
+    """
+    merged = {metric.name: metric.snapshot() for metric in _registry}
+    for snapshot in _otherSnapshots():
+        for metric in _registry:
+            values = merged[metric.name]
+            for key, value in snapshot.get(metric.name, []):
+                key = tuple(key)
+                values[key] = metric._merge(values[key], value) if key in values else value
+    lines = []
+    for metric in _registry:
+        lines += metric.render(merged[metric.name])
+    return "\n".join(lines) + "\n"
+
+
+# 每个进程一个快照文件; 名称带随机后缀, PID 复用时不会覆盖已退出进程的计数
+_snapshotPath = None
+
+
+def _resetSnapshotPath():
+    global _snapshotPath
+    _snapshotPath = os.path.join(MULTIPROC_DIR, f"metrics_{os.getpid()}_{uuid.uuid4().hex[:8]}.json") if MULTIPROC_DIR else None
+
+
+def flush():
+    """Write this process's values to its snapshot file in METRICS_MULTIPROC_DIR."""
+    if not _snapshotPath:
+        return
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in _registry}
+    tmp_path = _snapshotPath + ".tmp"
+    try:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, _snapshotPath)
+    except OSError as e:
+        print(f"[!] Could not write metrics snapshot {_snapshotPath}: {e}")
+
+
+def _otherSnapshots():
+    if not MULTIPROC_DIR:
+        return
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "metrics_*.json")):
+        if path == _snapshotPath:
+            continue
+        try:
+            with open(path) as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def _flushLoop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        flush()
+
+
+def _startFlusher():
+    _resetSnapshotPath()
+    if _snapshotPath:
+        threading.Thread(target=_flushLoop, daemon=True, name="metrics-flush").start()
+
+
+def _resetAfterFork():
+    # 子进程从零开始计数, 使用自己的快照文件
+    for metric in _registry:
+        metric._values = {}
+        metric._lock = threading.Lock()
+    _startFlusher()
+
+
+_startFlusher()
+os.register_at_fork(after_in_child=_resetAfterFork)
+atexit.register(flush)
+
+
+def _record(name, elapsed, items=None):
+    timings = request_timings_var.get()
+    if timings is not None:
+        entry = {"stage": name, "ms": round(elapsed * 1000, 2)}
+        if items is not None:
+            entry["items"] = items
+        timings.append(entry)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; ``yield``s a dict whose ``items`` may be set."""
+    info = {"items": None}
+    start = time.perf_counter()
+    try:
+        yield info
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if info["items"] is not None:
+            STAGE_ITEMS.inc(info["items"], stage=name)
+        _record(name, elapsed, info["items"])
+
+
+def _observeCall(service, operation, elapsed, status):
+    EXTERNAL_SECONDS.observe(elapsed, service=service, operation=operation)
+    EXTERNAL_CALLS.inc(service=service, operation=operation, status=status)
+    _record(f"{service}.{operation}", elapsed)
+
+
+@contextmanager
+def external_call(service, operation="request"):
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _observeCall(service, operation, time.perf_counter() - start, status)
+
+
+def measured(service, fn, operation="request"):
+    with external_call(service, operation):
+        return fn()
+
+
+def timed(name, count=None):
+    """Decorator timing a pipeline method as stage ``name``; ``count(self)`` gives its item count."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with stage(name) as info:
+                result = fn(self, *args, **kwargs)
+                if count is not None:
+                    info["items"] = count(self)
+            return result
+        return wrapper
+    return decorate
+
+
+def count_bytes(chunks, source, service=None):
+    """Pass chunks through, recording the total size once they are exhausted.
+
+    With ``service``, the time spent waiting for chunks (the body download,
+    excluding the consumer's parsing) is recorded as ``<service>.download``.
+    """
+    chunks = iter(chunks)
+    total = 0
+    waited = 0.0
+    status = "ok"
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            finally:
+                waited += time.perf_counter() - start
+            total += len(chunk)
+            yield chunk
+    except StopIteration:
+        pass
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        PAYLOAD_BYTES.observe(total, source=source)
+        if service:
+            _observeCall(service, "download", waited, status)
+
+
+def record_payload(source, value):
+    """Record the size of a received payload: bytes, str (UTF-8) or a JSON-like dict / list."""
+    if isinstance(value, (bytes, bytearray)):
+        size = len(value)
+    elif isinstance(value, str):
+        size = len(value.encode("utf-8"))
+    elif isinstance(value, (dict, list)):
+        size = len(json.dumps(value, default=str))
+    else:
+        return
+    PAYLOAD_BYTES.observe(size, source=source)
+
+
+def in_context(fn):
+    """Wrap ``fn`` to run in a copy of the caller's contextvars (request ID, timings).
+    ThreadPoolExecutor workers do not inherit them on their own."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        # 每次调用一个副本: 同一个 Context 不能被多个线程同时进入
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records every MongoDB command (find, update, aggregate, ...) as an external call."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+        try:
+            reply = event.reply
+            PAYLOAD_BYTES.observe(len(reply.raw) if hasattr(reply, "raw") else len(bson.encode(reply)), source="mongodb")
+        except Exception:
+            pass
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+    @staticmethod
+    def _observe(event, status):
+        elapsed = event.duration_micros / 1e6
+        EXTERNAL_SECONDS.observe(elapsed, service="mongodb", operation=event.command_name)
+        EXTERNAL_CALLS.inc(service="mongodb", operation=event.command_name, status=status)
+        _record(f"mongodb.{event.command_name}", elapsed)
@@ -0,0 +1,62 @@
+import atexit
+import os
+import threading
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from metrics import MongoCommandMetrics
+
+load_dotenv()
+
+# 每个进程一个 MongoClient, 由所有 endpoint 和 pipeline 类共享
+_client = None
+_lock = threading.Lock()
+
+
+def _clientOptions():
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        # 延迟到第一次操作再连接, 避免在 fork 之前建立连接
+        "connect": False,
+        "event_listeners": [MongoCommandMetrics()],
+    }
+    if os.getenv("MONGO_SOCKET_TIMEOUT_MS"):
+        options["socketTimeoutMS"] = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS"))
+    return options
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+                _client = MongoClient(mongo_url, **_clientOptions())
+    return _client
+
+
+def get_db(db_name=None):
+    return get_client()[db_name or os.getenv("MONGO_DB", "scavengerhunt")]
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _resetAfterFork():
+    # 子进程不能复用父进程的连接池和锁
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_resetAfterFork)
+atexit.register(close_client)
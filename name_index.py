@@ -0,0 +1,55 @@
+import unicodedata
+from collections import defaultdict
+
+
+def normalize_name(name):
+    """Case-fold a landmark name and drop whitespace and punctuation,
+    e.g. "The Quad / Aula Maxima" -> "thequadaulamaxima"."""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    return "".join(ch for ch in name if unicodedata.category(ch)[0] not in ("P", "Z") and not ch.isspace())
+
+
+class NameIndex:
+    """One-pass index of Overpass elements by their ``name`` tag.
+
+    Every element sharing a name is kept, in document order. The normalized
+    map is only built on the first normalized lookup.
+    """
+
+    def __init__(self, elements=None):
+        self.exact = defaultdict(list)
+        self._named = []
+        self._normalized = None
+        for entry in elements or []:
+            self.add(entry)
+
+    def add(self, entry):
+        info = entry.get("tags", None)
+        if not info or "name" not in info:
+            return
+        self.exact[info["name"]].append(entry)
+        self._named.append(entry)
+        if self._normalized is not None:
+            self._normalized[normalize_name(info["name"])].append(entry)
+
+    @property
+    def normalized(self):
+        # 全城提取不需要归一化名称, 按需构建
+        if self._normalized is None:
+            self._normalized = defaultdict(list)
+            for entry in self._named:
+                self._normalized[normalize_name(entry["tags"]["name"])].append(entry)
+        return self._normalized
+
+    def lookup(self, name):
+        return self.exact.get(name, [])
+
+    def lookupNormalized(self, name):
+        return self.normalized.get(normalize_name(name), [])
+
+    def find(self, name):
+        # 优先精确匹配, 找不到再用归一化名称
+        return self.lookup(name) or self.lookupNormalized(name)
+
+    def __len__(self):
+        return len(self.exact)
@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STALE_TMP_SECONDS = 3600
+
+
+class OverpassCache:
+    """On-disk cache of Overpass response bodies.
+
+    Entries are gzip files named by the SHA-256 of the normalized query text.
+    The file mtime is the write time (TTL), the atime is the last hit (LRU).
+    """
+
+    def __init__(self, cache_dir=None, ttl=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.getenv("OVERPASS_CACHE_DIR", os.path.join("outputfiles", "overpass_cache"))
+        self.ttl = ttl if ttl is not None else int(os.getenv("OVERPASS_CACHE_TTL", str(7 * 24 * 3600)))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("OVERPASS_CACHE_MAX_MB", "512")) * 1024 * 1024
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(query):
+        normalized = re.sub(r"\s+", " ", query).strip()
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _path(self, query):
+        return os.path.join(self.cache_dir, f"{self.key(query)}.json.gz")
+
+    def _fresh(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if self.ttl and time.time() - stat.st_mtime > self.ttl:
+            self._remove(path)
+            return False
+        # 记录最近一次命中时间, 用于 LRU 淘汰
+        os.utime(path, (time.time(), stat.st_mtime))
+        return True
+
+    def get(self, query):
+        path = self._path(query)
+        if not self._fresh(path):
+            return None
+        try:
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        except (OSError, EOFError):
+            self._remove(path)
+            return None
+
+    def open(self, query):
+        """Return a readable binary file for a cached body, or None on a miss."""
+        path = self._path(query)
+        if not self._fresh(path):
+            return None
+        return gzip.open(path, "rb")
+
+    def put(self, query, data):
+        writer = self.writer(query)
+        writer.write(data)
+        writer.commit()
+
+    def writer(self, query):
+        return _CacheWriter(self, self._path(query))
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith((".json.gz", ".tmp")):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # 进程中断留下的临时文件; 写入中的文件 mtime 会不断更新
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        self._remove(path)
+                    continue
+                if self.ttl and now - stat.st_mtime > self.ttl:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _CacheWriter:
+    # 先写临时文件, 完整写入后再 rename, 避免并发读到半截数据
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.cache_dir, suffix=".tmp")
+        self._file = gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb", compresslevel=6)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        fileobj = self._file.fileobj
+        self._file.close()
+        fileobj.close()
+        os.replace(self.tmp_path, self.path)
+        self.cache.evict()
+
+    def abort(self):
+        fileobj = self._file.fileobj
+        self._file.close()
+        fileobj.close()
+        OverpassCache._remove(self.tmp_path)
@@ -0,0 +1,179 @@
+import codecs
+import json
+import re
+
+# Overpass 返回体结构: {"version": ..., "osm3s": {...}, "elements": [ {...}, {...} ]}
+# 这里逐个解析 elements 数组里的对象, 不在内存中构建完整文档
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+# 查询超时 / 内存不足时 Overpass 仍返回 200, elements 为空或不完整, 并附带顶层 "remark"
+_REMARK = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+_TRAILING_REMARK = re.compile(r'\]\s*,\s*"remark"\s*:\s*("(?:[^"\\]|\\.)*")\s*\}\s*$')
+
+
+class OverpassError(RuntimeError):
+    """Overpass answered 200 but reported a runtime error (timeout, out of memory)."""
+
+
+def overpass_remark(text):
+    """Top-level ``remark`` of a complete Overpass JSON body, or None."""
+    match = _TRAILING_REMARK.search(text[-8192:])
+    return json.loads(match.group(1)) if match else None
+
+
+def iter_elements(chunks):
+    """Yield each entry of the top-level ``elements`` array from an iterable of
+    str/bytes chunks, keeping only the unparsed tail of the body in memory.
+
+    Raises OverpassError once the body turns out to carry a ``remark``.
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    exhausted = False
+
+    def more():
+        nonlocal buf, exhausted
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buf += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+            return True
+        if not exhausted:
+            buf += utf8.decode(b"", final=True)
+            exhausted = True
+        return False
+
+    def check_remark(text):
+        match = _REMARK.search(text)
+        if match:
+            raise OverpassError(f"Incomplete Overpass result: {json.loads(match.group(1))}")
+
+    # 1. 定位 "elements": [
+    pos = 0
+    while True:
+        key = buf.find('"elements"', pos)
+        if key != -1:
+            start = buf.find("[", key)
+            if start != -1:
+                check_remark(buf[:key])
+                pos = start + 1
+                break
+        else:
+            # 保留尾部, 防止 key 被切分在两个 chunk 之间
+            pos = max(0, len(buf) - len('"elements"'))
+        if not more():
+            raise ValueError("Overpass response has no 'elements' array.")
+
+    # 2. 逐个解码数组元素
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE + ",":
+            pos += 1
+        if pos >= len(buf):
+            buf, pos = "", 0
+            if not more():
+                raise ValueError("Overpass response ended inside 'elements'.")
+            continue
+        if buf[pos] == "]":
+            # 读完剩余内容 (只有几个顶层字段), 检查是否带有 remark
+            tail, buf = buf[pos + 1:], ""
+            while more():
+                tail, buf = tail + buf, ""
+            check_remark(tail + buf)
+            return
+        try:
+            element, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+            # 当前元素不完整: 丢弃已消费部分, 读到缓冲区至少翻倍再重新解码,
+            # 大元素 (跨越很多 chunk) 的解码总代价保持线性
+            buf, pos = buf[pos:], 0
+            target = 2 * len(buf)
+            while len(buf) < target and more():
+                pass
+            continue
+        yield element
+        buf, pos = buf[end:], 0
+
+
+class TeeStream:
+    """Iterate the elements of a response body while copying its raw chunks to
+    writers (``write`` / ``commit`` / ``abort``).
+
+    The writers are opened by ``openers`` on the first ``next()``, so a stream
+    that is never read leaves no temporary files. They are committed once the
+    whole body has been parsed without a remark, and aborted on any error or
+    on ``close()``. ``finish()`` copies the unread rest of the body without
+    parsing it, for consumers that stop early.
+    """
+
+    def __init__(self, chunks, openers):
+        self._chunks = iter(chunks)
+        self._openers = openers
+        self._writers = None
+        self._elements = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._elements is None:
+            self._open()
+            self._elements = iter_elements(self._tee())
+        try:
+            return next(self._elements)
+        except StopIteration:
+            self._close(commit=True)
+            raise
+        except BaseException:
+            self._close(commit=False)
+            raise
+
+    def finish(self):
+        """Copy the rest of the body to the writers; commit if it is complete."""
+        if self._writers is None:
+            self._open()
+        tail = b""
+        try:
+            for chunk in self._tee():
+                tail = (tail + (chunk.encode("utf-8") if isinstance(chunk, str) else chunk))[-8192:]
+        except BaseException:
+            self._close(commit=False)
+            raise
+        text = tail.decode("utf-8", errors="ignore").rstrip()
+        # 截断或带 remark 的响应体不提交
+        self._close(commit=text.endswith("}") and overpass_remark(text) is None)
+
+    def close(self):
+        self._close(commit=False)
+
+    def __del__(self):
+        self.close()
+
+    def _open(self):
+        self._writers = []
+        try:
+            for opener in self._openers:
+                self._writers.append(opener())
+        except BaseException:
+            self._close(commit=False)
+            raise
+
+    def _tee(self):
+        for chunk in self._chunks:
+            for writer in self._writers:
+                writer.write(chunk)
+            yield chunk
+
+    def _close(self, commit):
+        writers, self._writers = self._writers or [], []
+        for writer in writers:
+            if commit:
+                writer.commit()
+            else:
+                writer.abort()
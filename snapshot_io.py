@@ -0,0 +1,199 @@
+import gzip
+import io
+import json
+import mmap
+import os
+
+# 快照文件: NDJSON (每行一个 JSON 对象), 按扩展名选择压缩方式
+#   landmarks.ndjson / landmarks.ndjson.gz / landmarks.ndjson.zst (.jsonl 同理)
+# zstd 需要可选依赖 zstandard
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+CHUNK_SIZE = 64 * 1024
+
+
+def compression(path):
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def is_ndjson(path):
+    base = path[:-len(".gz")] if path.endswith(".gz") else path[:-len(".zst")] if path.endswith(".zst") else path
+    return base.endswith((".ndjson", ".jsonl"))
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd snapshots need the optional 'zstandard' package (pip install zstandard)") from e
+    return zstandard
+
+
+def _wrap(raw, kind, writing):
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb" if writing else "rb", compresslevel=GZIP_LEVEL)
+    if kind == "zstd":
+        zstandard = _zstandard()
+        if writing:
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw)
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return raw
+
+
+class _SnapshotFile(io.TextIOWrapper):
+    # 关闭时连同底层文件一起关闭 (GzipFile 不会关闭传入的 fileobj)
+
+    def __init__(self, raw, kind, writing):
+        self._raw = raw
+        super().__init__(_wrap(raw, kind, writing), encoding="utf-8", newline="\n" if writing else None)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
+
+def open_text(path, mode="r", kind=None):
+    """UTF-8 text file for ``path``, (de)compressed by its extension unless ``kind`` is given."""
+    writing = mode.startswith("w")
+    kind = kind or compression(path)
+    if kind == "zstd":
+        # 缺少依赖时在创建文件之前报错
+        _zstandard()
+    return _SnapshotFile(open(path, "wb" if writing else "rb"), kind, writing)
+
+
+def _mapped(f):
+    # 空文件无法 mmap
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_chunks(path, size=CHUNK_SIZE):
+    """Yield the decompressed bytes of ``path`` in ``size`` chunks.
+    Uncompressed files are memory-mapped rather than read into memory."""
+    kind = compression(path)
+    if kind == "zstd":
+        _zstandard()
+    with open(path, "rb") as raw:
+        if kind is None:
+            mapped = _mapped(raw)
+            if mapped is None:
+                return
+            with mapped:
+                for start in range(0, len(mapped), size):
+                    yield mapped[start:start + size]
+            return
+        with _wrap(raw, kind, False) as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+def iter_ndjson(path):
+    """Yield the object on each non-empty line of an NDJSON snapshot, one line in memory at a time."""
+    if compression(path) is None:
+        with open(path, "rb") as raw:
+            mapped = _mapped(raw)
+            if mapped is None:
+                return
+            with mapped:
+                for line in iter(mapped.readline, b""):
+                    if line.strip():
+                        yield json.loads(line)
+        return
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class NDJSONWriter:
+    """Append one JSON object per line to ``path``.
+
+    Lines go to ``path + ".tmp"``; ``commit`` renames it into place, so an
+    interrupted export never replaces a complete snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmpPath = path + ".tmp"
+        self.count = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open_text(self.tmpPath, "w", kind=compression(path))
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+        self.count += 1
+        return self
+
+    def writeMany(self, records):
+        for record in records:
+            self.write(record)
+        return self
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmpPath, self.path)
+        return self
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmpPath)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class RawWriter:
+    """Write a raw response body (bytes) to ``path``, compressed by its extension,
+    via ``path + ".tmp"``; same write / commit / abort interface as the Overpass cache writer."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmpPath = path + ".tmp"
+        kind = compression(path)
+        if kind == "zstd":
+            _zstandard()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._raw = open(self.tmpPath, "wb")
+        self._file = _wrap(self._raw, kind, True)
+
+    def write(self, data):
+        self._file.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def _close(self):
+        try:
+            self._file.close()
+        finally:
+            self._raw.close()
+
+    def commit(self):
+        self._close()
+        os.replace(self.tmpPath, self.path)
+
+    def abort(self):
+        self._close()
+        try:
+            os.remove(self.tmpPath)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,193 @@
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from city_imports import SingleFlight, get_import_record
+from mongo_pool import get_db
+
+load_dotenv()
+
+EARTH_RADIUS_M = 6371008.8
+
+
+class GridIndex:
+    """Uniform grid over one city's landmarks.
+
+    Every landmark is registered in each cell its bounding box overlaps, and
+    distances are measured to the bounding box (0 when the point is inside),
+    in local equirectangular metres around the city's mean latitude.
+    """
+
+    def __init__(self, landmarks, cell_size=None):
+        self.cell_size = cell_size or float(os.getenv("NEARBY_GRID_CELL_M", "250"))
+        self.landmarks = []
+        boxes = []
+        for doc in landmarks:
+            centroid = doc.get("centroid") or {}
+            lat, lng = centroid.get("latitude"), centroid.get("longitude")
+            if lat is None or lng is None:
+                continue
+            bbox = doc.get("bbox") or {"minLat": lat, "minLon": lng, "maxLat": lat, "maxLon": lng}
+            boxes.append((bbox["minLat"], bbox["minLon"], bbox["maxLat"], bbox["maxLon"]))
+            self.landmarks.append({
+                "landmarkId": str(doc["_id"]),
+                "name": doc.get("name"),
+                "centroid": {"latitude": lat, "longitude": lng},
+                "tags": doc.get("tags") or {},
+            })
+
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        self.lat0 = float(boxes[:, [0, 2]].mean()) if len(boxes) else 0.0
+        self._kx = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(self.lat0))
+        self._ky = math.radians(1) * EARTH_RADIUS_M
+        self.minX = boxes[:, 1] * self._kx
+        self.maxX = boxes[:, 3] * self._kx
+        self.minY = boxes[:, 0] * self._ky
+        self.maxY = boxes[:, 2] * self._ky
+
+        cells = defaultdict(list)
+        for i, (x0, y0, x1, y1) in enumerate(zip(self._cell(self.minX).tolist(), self._cell(self.minY).tolist(),
+                                                 self._cell(self.maxX).tolist(), self._cell(self.maxY).tolist())):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells[(cx, cy)].append(i)
+        self.cells = {cell: np.array(ids, dtype=np.int64) for cell, ids in cells.items()}
+        self.builtAt = time.time()
+        self.checkedAt = self.builtAt
+        self.importedAt = None
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def _cell(self, values):
+        return np.floor(values / self.cell_size).astype(np.int64)
+
+    def withinRadius(self, lat, lng, radius, tags=None):
+        """[(distance, landmark), ...] within ``radius`` metres, nearest first."""
+        px, py = float(lng) * self._kx, float(lat) * self._ky
+        x0, x1 = math.floor((px - radius) / self.cell_size), math.floor((px + radius) / self.cell_size)
+        y0, y1 = math.floor((py - radius) / self.cell_size), math.floor((py + radius) / self.cell_size)
+
+        buckets = [self.cells[(cx, cy)] for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)
+                   if (cx, cy) in self.cells]
+        if not buckets:
+            return []
+        ids = np.unique(np.concatenate(buckets)) if len(buckets) > 1 else buckets[0]
+
+        dx = np.maximum(np.maximum(self.minX[ids] - px, px - self.maxX[ids]), 0.0)
+        dy = np.maximum(np.maximum(self.minY[ids] - py, py - self.maxY[ids]), 0.0)
+        dist = np.hypot(dx, dy)
+        inside = dist <= radius
+        ids, dist = ids[inside], dist[inside]
+        order = np.argsort(dist, kind="stable")
+
+        result = []
+        for i, d in zip(ids[order].tolist(), dist[order].tolist()):
+            landmark = self.landmarks[i]
+            if tags and not match_tags(landmark["tags"], tags):
+                continue
+            result.append((d, landmark))
+        return result
+
+    def nearest(self, lat, lng, k, tags=None, max_radius=None):
+        """The ``k`` nearest landmarks, searching outwards up to ``max_radius`` metres."""
+        max_radius = max_radius or float(os.getenv("NEARBY_MAX_RADIUS_M", "5000"))
+        radius = self.cell_size
+        while True:
+            result = self.withinRadius(lat, lng, radius, tags)
+            # 半径内已有 k 个结果时, 它们就是全局最近的 k 个
+            if len(result) >= k or radius >= max_radius:
+                return result[:k]
+            radius = min(radius * 2, max_radius)
+
+
+def match_tags(landmark_tags, filters):
+    """All filters must match: a string value must be equal, a list must contain
+    the tag value, ``True``/``None``/``"*"`` only requires the key to exist."""
+    for key, expected in filters.items():
+        value = landmark_tags.get(key)
+        if value is None:
+            return False
+        if expected is None or expected is True or expected == "*":
+            continue
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class NearbyIndex:
+    """Per-city GridIndex cache, built from the ``landmarks`` collection on first
+    use and rebuilt after ``invalidate`` or once it is older than ``ttl`` seconds.
+
+    Every ``check_interval`` seconds a background thread compares the city's
+    ``city_imports`` record with the one the index was built from, so an
+    import in another worker is picked up without a MongoDB read on the
+    lookup path.
+    """
+
+    def __init__(self, ttl=None, collection_name="landmarks", check_interval=None):
+        self.ttl = ttl if ttl is not None else int(os.getenv("NEARBY_INDEX_TTL", "600"))
+        self.check_interval = check_interval if check_interval is not None \
+            else float(os.getenv("NEARBY_INDEX_CHECK_SECONDS", "5"))
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._flight = SingleFlight()
+
+    def get(self, city):
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(city)
+            check = index is not None and now - index.checkedAt >= self.check_interval
+            if check:
+                # 同一索引在一个周期内只检查一次
+                index.checkedAt = now
+        if index is None or (self.ttl and now - index.builtAt >= self.ttl):
+            # 同一城市同时只构建一次
+            index, _ = self._flight.do(city, lambda: self._build(city))
+            return index
+        if check:
+            threading.Thread(target=self._checkImport, args=(city, index), daemon=True,
+                             name=f"nearby-check-{city}").start()
+        return index
+
+    def _checkImport(self, city, index):
+        try:
+            if self._importedAt(city) != index.importedAt:
+                self._flight.do(city, lambda: self._build(city))
+        except Exception as e:
+            print(f"[Nearby] Could not check the import record of {city}: {e}")
+
+    def invalidate(self, city=None):
+        with self._lock:
+            if city is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(city, None)
+
+    def _importedAt(self, city):
+        record = get_import_record(city)
+        return record.get("importedAt") if record else None
+
+    def _build(self, city):
+        start = time.time()
+        # 先读导入时间再读地标: 构建期间完成的导入会让下次查询重建
+        imported_at = self._importedAt(city)
+        cursor = get_db()[self.collection_name].find(
+            {"city": city, "deleted": {"$ne": True}},
+            {"name": 1, "centroid": 1, "bbox": 1, "tags": 1}
+        )
+        index = GridIndex(cursor)
+        index.importedAt = imported_at
+        with self._lock:
+            self._indexes[city] = index
+        print(f"[Nearby] Indexed {len(index)} landmarks for {city} in {time.time() - start:.2f}s")
+        return index
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Import-time breakdown of a module, from ``python -X importtime``.
+
+    python startup_report.py                 # app (what every gunicorn worker imports)
+    python startup_report.py inject_way --top 30
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(module):
+    """[(self_us, cumulative_us, depth, name), ...] for a fresh ``import module``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), (len(indent) - 1) // 2, name))
+    return rows
+
+
+def report(module, top=20):
+    rows = import_times(module)
+    total = next((cumulative for _, cumulative, depth, name in rows if depth == 0 and name == module), 0)
+
+    # 按顶层包汇总 self 时间
+    packages = defaultdict(int)
+    for self_us, _, _, name in rows:
+        packages[name.split(".")[0]] += self_us
+
+    print(f"[✓] import {module}: {total / 1000:.1f}ms ({len(rows)} modules)\n")
+    print(f"{'package':<32} {'ms':>9} {'share':>7}")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<32} {self_us / 1000:>9.1f} {self_us / max(total, 1):>7.1%}")
+    return {"module": module, "totalMs": total / 1000, "packages": dict(packages)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time breakdown of a module.")
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    report(args.module, args.top)
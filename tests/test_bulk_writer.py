@@ -0,0 +1,75 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from bulk_writer import DUPLICATE_KEY_ERROR, bulk_upsert, summarize
+
+
+class FakeCollection:
+    """Records each bulk_write batch and answers with the next scripted result.
+
+    A result with ``writeErrors`` is raised as BulkWriteError, like an
+    unordered bulk_write that hit duplicate keys or other write errors.
+    """
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.batches = []
+
+    def bulk_write(self, requests, ordered=True):
+        assert not ordered
+        self.batches.append(list(requests))
+        details = self.results.pop(0)
+        if details.get("writeErrors"):
+            raise BulkWriteError(details)
+        return _Result(details)
+
+
+class _Result:
+    def __init__(self, details):
+        self.bulk_api_result = details
+
+
+def result(upserted=0, inserted=0, matched=0, modified=0, errors=()):
+    return {"nUpserted": upserted, "nInserted": inserted, "nMatched": matched, "nModified": modified,
+            "writeErrors": [{"index": index, "code": code, "errmsg": f"error {code}"} for index, code in errors]}
+
+
+def ops(n):
+    return [UpdateOne({"name": f"landmark {i}"}, {"$setOnInsert": {"i": i}}, upsert=True) for i in range(n)]
+
+
+def test_batches_and_counts():
+    collection = FakeCollection([result(upserted=2, matched=1, modified=0), result(upserted=1, matched=1, modified=1)])
+    batches = bulk_upsert(collection, ops(5), batch_size=3)
+    assert [len(batch) for batch in collection.batches] == [3, 2]
+    assert [(b["inserted"], b["updated"], b["skipped"], b["failed"]) for b in batches] == [(2, 0, 1, 0), (1, 1, 0, 0)]
+    assert summarize(batches) == {"batches": 2, "inserted": 3, "updated": 1, "skipped": 1, "failed": 0}
+
+
+def test_duplicate_keys_are_skipped_not_failed():
+    # 守卫过滤条件未命中已有文档时 upsert 触发唯一索引冲突, 视为跳过
+    collection = FakeCollection([
+        result(upserted=1, errors=[(0, DUPLICATE_KEY_ERROR), (2, DUPLICATE_KEY_ERROR)]),
+        result(upserted=0, matched=1, modified=1, errors=[(1, 121)]),
+    ])
+    batches = bulk_upsert(collection, ops(5), batch_size=3)
+    first, second = batches
+    assert (first["inserted"], first["skipped"], first["failed"]) == (1, 2, 0)
+    assert (second["updated"], second["skipped"], second["failed"]) == (1, 0, 1)
+    # 错误位置换算成 operations 中的全局下标
+    assert first["skippedOps"] == [0, 2] and first["failedOps"] == []
+    assert second["skippedOps"] == [] and second["failedOps"] == [4]
+    assert summarize(batches) == {"batches": 2, "inserted": 1, "updated": 1, "skipped": 2, "failed": 1}
+
+
+def test_matched_unmodified_and_duplicates_add_up():
+    collection = FakeCollection([result(upserted=1, matched=2, modified=1, errors=[(3, DUPLICATE_KEY_ERROR)])])
+    (batch,) = bulk_upsert(collection, ops(5))
+    assert batch["size"] == 5
+    assert (batch["inserted"], batch["updated"], batch["skipped"]) == (1, 1, 2)
+
+
+def test_no_operations():
+    collection = FakeCollection([])
+    assert bulk_upsert(collection, []) == []
+    assert collection.batches == []
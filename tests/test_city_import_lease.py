@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import city_imports
+from city_imports import CityImportLease, imports_collection
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(city_imports, "get_db", lambda name=None: db)
+    monkeypatch.setattr(city_imports, "_indexed", False)
+    return db
+
+
+def run_all(calls):
+    """Run each (lease, city, fn) in its own thread, like requests in different workers."""
+    results, errors = [], []
+
+    def call(lease, city, fn):
+        try:
+            results.append(lease.do(city, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=args) for args in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def workers():
+    # 两个租约对象相当于两个 worker 进程
+    return CityImportLease(ttl=0.3, poll=0.02), CityImportLease(ttl=0.3, poll=0.02)
+
+
+def test_one_import_is_shared_across_workers():
+    runs = []
+
+    def import_city():
+        runs.append(1)
+        # 导入时间超过 ttl: 续租让其他 worker 继续等待
+        time.sleep(0.5)
+        return 42
+
+    first, second = workers()
+    results, errors = run_all([(first, "Cork", import_city), (first, "Cork", import_city),
+                               (second, "Cork", import_city), (second, "Cork", import_city)])
+    assert not errors
+    assert len(runs) == 1
+    assert sorted(results) == [(42, False), (42, True), (42, True), (42, True)]
+
+    record = imports_collection().find_one({"city": "Cork"})
+    assert record["lease"] is None
+    assert record["lastLease"]["result"] == 42 and record["lastLease"]["error"] is None
+
+
+def test_failure_is_shared_with_waiting_workers():
+    def import_city():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    first, second = workers()
+    results, errors = run_all([(first, "Galway", import_city), (second, "Galway", import_city)])
+    assert not results
+    assert sorted(type(e).__name__ for e in errors) == ["RuntimeError", "ValueError"]
+    assert "boom" in str(next(e for e in errors if isinstance(e, RuntimeError)))
+    assert imports_collection().find_one({"city": "Galway"})["lastLease"]["error"] == "boom"
+
+
+def test_expired_lease_of_a_dead_worker_is_taken_over():
+    until = datetime.now(timezone.utc) + timedelta(seconds=0.2)
+    imports_collection().insert_one({"city": "Sligo", "lease": {"owner": "dead", "until": until}})
+    _, lease = workers()
+    started = time.monotonic()
+    assert lease.do("Sligo", lambda: 7) == (7, False)
+    assert time.monotonic() - started >= 0.15
+    assert imports_collection().find_one({"city": "Sligo"})["lastLease"]["result"] == 7
+
+
+def test_later_import_runs_again():
+    first, second = workers()
+    assert first.do("Cork", lambda: 1) == (1, False)
+    # 之前的 lastLease 不属于当前等待的导入, 不会被共享
+    assert second.do("Cork", lambda: 2) == (2, False)
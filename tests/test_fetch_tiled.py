@@ -0,0 +1,100 @@
+import json
+import threading
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import landmark_preprocessor
+from landmark_preprocessor import BBOX_PLACEHOLDER, LandmarkPreprocessor, split_bbox
+
+BBOX = (51.88, -8.50, 51.90, -8.46)
+QUERY = f"[out:json];way[tourism]({BBOX_PLACEHOLDER});out geom;"
+
+
+class StubOverpass(ThreadingHTTPServer):
+    """Answers each tile query with elements of that tile plus elements that
+    every tile shares (a way crossing the tile edges, and a node with the same
+    id). Tiles in ``fail_once`` answer 500 on their first request."""
+
+    def __init__(self, fail_once=()):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.fail_once = set(fail_once)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/interpreter"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        query = form["data"][0]
+        tile = query[query.index("(") + 1:query.index(")")]
+        with self.server.lock:
+            self.server.requests[tile] += 1
+            fail = tile in self.server.fail_once and self.server.requests[tile] == 1
+        if fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        elements = [
+            {"type": "way", "id": 1, "tags": {"name": "Shared Way"}},
+            {"type": "node", "id": 1, "tags": {"name": "Node One"}},
+            {"type": "way", "id": zlib.crc32(tile.encode()) + 10, "tags": {"tile": tile}},
+        ]
+        body = json.dumps({"version": 0.6, "elements": elements}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def overpass(monkeypatch, request):
+    tiles = [",".join(f"{v:.6f}" for v in tile) for tile in split_bbox(BBOX, 2, 2)]
+    server = StubOverpass(fail_once=tiles[:getattr(request, "param", 1)])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OVERPASS_URL", server.url)
+    # 重试间隔不真正等待
+    delays = []
+    monkeypatch.setattr(landmark_preprocessor.time, "sleep", delays.append)
+    server.tiles, server.delays = tiles, delays
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_failed_tile_is_retried_and_results_merge(overpass):
+    processor = LandmarkPreprocessor(QUERY, city="Cork").fetchTiled(BBOX, rows=2, cols=2, workers=2, use_cache=False)
+
+    assert overpass.requests == Counter({overpass.tiles[0]: 2, **{tile: 1 for tile in overpass.tiles[1:]}})
+    assert overpass.delays == [1]
+    keys = [(e["type"], e["id"]) for e in processor.rawElements]
+    # 按 (type, id) 去重: 共享的 way 和同 id 的 node 各保留一个, 每个分块各一个独有 way
+    assert len(keys) == len(set(keys)) == 6
+    assert {("way", 1), ("node", 1)} <= set(keys)
+    assert {e["tags"]["tile"] for e in processor.rawElements if "tile" in e["tags"]} == set(overpass.tiles)
+
+
+@pytest.mark.parametrize("overpass", [4], indirect=True)
+def test_tiles_fail_after_retries(overpass):
+    processor = LandmarkPreprocessor(QUERY, city="Cork")
+    with pytest.raises(RuntimeError, match="4/4 Overpass tiles failed"):
+        processor.fetchTiled(BBOX, rows=2, cols=2, retries=0, use_cache=False)
+    assert processor.rawElements is None
+
+
+def test_query_needs_placeholder():
+    with pytest.raises(ValueError):
+        LandmarkPreprocessor("[out:json];way[tourism];out geom;").fetchTiled(BBOX, rows=2, cols=2)
@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+import pytest
+
+from geometry import EARTH_RADIUS_M, compute_geometry_stats, pack_geometries, simplify_mask
+
+UNIT = 0.001  # 度
+
+
+def ring(points, lat0=0.0, lon0=0.0, unit=UNIT):
+    vertices = [{"lat": lat0 + y * unit, "lon": lon0 + x * unit} for x, y in points]
+    return vertices + vertices[:1]
+
+
+def stats(geometries):
+    return compute_geometry_stats(*pack_geometries(geometries))
+
+
+def test_rectangle_area_and_centroid():
+    lat0, lon0 = 51.89, -8.48
+    result = stats([ring([(0, 0), (3, 0), (3, 2), (0, 2)], lat0, lon0)])
+    height = math.radians(2 * UNIT) * EARTH_RADIUS_M
+    width = math.radians(3 * UNIT) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+    assert result["area"][0] == pytest.approx(width * height, rel=1e-9)
+    assert result["perimeter"][0] == pytest.approx(2 * (width + height), rel=1e-6)
+    assert result["latitude"][0] == pytest.approx(lat0 + UNIT, abs=1e-9)
+    assert result["longitude"][0] == pytest.approx(lon0 + 1.5 * UNIT, abs=1e-9)
+    assert (result["minLat"][0], result["maxLon"][0]) == (lat0, lon0 + 3 * UNIT)
+
+
+def test_centroid_is_area_weighted():
+    # L 形: 三个单位正方形, 形心 (5/6, 5/6), 而顶点平均值是 (1, 1)
+    l_shape = [(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)]
+    result = stats([ring(l_shape)])
+    assert result["latitude"][0] == pytest.approx(5 / 6 * UNIT, abs=1e-12)
+    assert result["longitude"][0] == pytest.approx(5 / 6 * UNIT, abs=1e-12)
+    unit_m = math.radians(UNIT) * EARTH_RADIUS_M
+    assert result["area"][0] == pytest.approx(3 * unit_m ** 2, rel=1e-9)
+
+
+def test_orientation_does_not_matter():
+    square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+    clockwise, counter = stats([ring(square), ring(square[::-1])])["area"]
+    assert clockwise == pytest.approx(counter) and clockwise > 0
+
+
+def test_open_way_and_node_fall_back_to_vertex_mean():
+    open_way = ring([(0, 0), (2, 0), (2, 2)])[:-1]
+    node = [{"lat": 1.5, "lon": 2.5}]
+    result = stats([open_way, node])
+    np.testing.assert_allclose(result["area"], [0.0, 0.0])
+    assert result["latitude"][0] == pytest.approx(2 / 3 * UNIT)
+    assert result["longitude"][0] == pytest.approx(4 / 3 * UNIT)
+    # 非闭合 way 不计算首尾连线
+    assert result["perimeter"][0] == pytest.approx(4 * math.radians(UNIT) * EARTH_RADIUS_M, rel=1e-6)
+    assert (result["latitude"][1], result["longitude"][1], result["perimeter"][1]) == (1.5, 2.5, 0.0)
+
+
+def test_stats_are_per_landmark():
+    square = ring([(0, 0), (1, 0), (1, 1), (0, 1)])
+    big = ring([(0, 0), (2, 0), (2, 2), (0, 2)], lat0=0.01)
+    result = stats([square, big, square])
+    assert result["area"][1] == pytest.approx(4 * result["area"][0], rel=1e-6)
+    assert result["area"][0] == result["area"][2]
+
+
+def dense_square(per_edge):
+    # 每条边上插入共线顶点的闭合正方形
+    steps = [i / per_edge for i in range(per_edge)]
+    points = [(s, 0) for s in steps] + [(1, s) for s in steps] + [(1 - s, 1) for s in steps] + [(0, 1 - s) for s in steps]
+    return ring(points)
+
+
+def mask(geometries, tolerance):
+    lat, lon, offsets = pack_geometries(geometries)
+    return simplify_mask(lat, lon, offsets, tolerance), offsets
+
+
+def test_simplify_keeps_square_corners():
+    square = dense_square(5)
+    keep, _ = mask([square], tolerance=1.0)
+    kept = [v for v, k in zip(square, keep) if k]
+    assert kept[0] == kept[-1] == square[0]
+    assert {(v["lat"], v["lon"]) for v in kept} == {(0.0, 0.0), (0.0, UNIT), (UNIT, UNIT), (UNIT, 0.0)}
+    assert len(kept) == 5
+
+
+def test_simplify_never_collapses_a_ring():
+    # 远小于容差的闭合环: 简化后不足四个顶点, 整体保留
+    tiny = ring([(0, 0), (1, 0), (1, 1), (0.5, 1.2), (0, 1)], unit=1e-7)
+    keep, _ = mask([tiny], tolerance=5.0)
+    assert keep.all()
+
+
+def test_simplify_small_rings_untouched_and_endpoints_kept():
+    triangle = ring([(0, 0), (1, 0), (0, 1)])
+    line = [{"lat": 0.0, "lon": x * UNIT} for x in range(6)]
+    square = dense_square(3)
+    keep, offsets = mask([triangle, line, square], tolerance=1.0)
+    assert keep[offsets[0]:offsets[1]].all()
+    # 共线的开放 way 只剩首尾
+    assert keep[offsets[1]:offsets[2]].tolist() == [True, False, False, False, False, True]
+    ring_keep = keep[offsets[2]:offsets[3]]
+    assert ring_keep[0] and ring_keep[-1] and ring_keep.sum() == 5
+
+
+def test_zero_tolerance_keeps_everything():
+    keep, _ = mask([dense_square(4)], tolerance=0)
+    assert keep.all()
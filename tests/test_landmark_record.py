@@ -0,0 +1,134 @@
+import copy
+import json
+
+import numpy as np
+import pytest
+
+from geometry import compute_geometry_stats, element_geometry, pack_geometries, simplify_mask
+from landmark_preprocessor import LandmarkPreprocessor
+from landmark_record import LandmarkRecord
+
+
+def way(osm_id, name, points, **tags):
+    return {
+        "type": "way", "id": osm_id, "version": 3, "timestamp": "2024-05-01T12:00:00Z",
+        "tags": {"name": name, **tags},
+        "geometry": [{"lat": lat, "lon": lon} for lat, lon in points],
+    }
+
+
+ELEMENTS = [
+    # 正方形, 一条边上有一个共线顶点 (简化时去掉)
+    way(1, "Boole Library", [(51.89301, -8.49201), (51.89301, -8.49151), (51.89301, -8.49101),
+                             (51.89351, -8.49101), (51.89351, -8.49201), (51.89301, -8.49201)], tourism="attraction"),
+    way(2, "Tŷ Coch", [(51.8941234567, -8.4923456789), (51.8942345678, -8.4911234567)], historic="building"),
+    way(3, "Glucksman", [(51.8951, -8.4961), (51.8954, -8.4955), (51.8957, -8.4962)]),
+]
+
+
+def reference_packages(elements, tolerance, precision, pairs):
+    """processedLandmarks as the dict-based implementation built them."""
+    batch = [(entry["tags"]["name"], entry, element_geometry(entry)) for entry in elements]
+    lat, lon, offsets = pack_geometries([geometry for _, _, geometry in batch])
+    stats = {field: values.tolist() for field, values in compute_geometry_stats(lat, lon, offsets).items()}
+    keep = simplify_mask(lat, lon, offsets, tolerance)
+    starts = offsets.tolist()
+    kept = np.add.reduceat(keep, offsets[:-1]).tolist()
+
+    res = {}
+    for i, (key, info, geometry) in enumerate(batch):
+        count = starts[i + 1] - starts[i]
+        geometry = [geometry[j] for j in np.flatnonzero(keep[starts[i]:starts[i + 1]]).tolist()]
+        if pairs:
+            geometry = [[pt["lon"], pt["lat"]] for pt in geometry]
+            if precision is not None:
+                geometry = [[round(x, precision) for x in pt] for pt in geometry]
+        elif precision is not None:
+            geometry = [{"lat": round(pt["lat"], precision), "lon": round(pt["lon"], precision)} for pt in geometry]
+        tags = dict(info["tags"])
+        res[key] = {
+            "name": tags.pop("name"),
+            "osmType": info["type"],
+            "osmId": info["id"],
+            "osmVersion": info["version"],
+            "osmTimestamp": info["timestamp"],
+            "latitude": stats["latitude"][i],
+            "longitude": stats["longitude"][i],
+            "bbox": {
+                "minLat": stats["minLat"][i],
+                "minLon": stats["minLon"][i],
+                "maxLat": stats["maxLat"][i],
+                "maxLon": stats["maxLon"][i],
+            },
+            "area": stats["area"][i],
+            "perimeter": stats["perimeter"][i],
+            "geometry": geometry,
+            "compression": {
+                "sourceVertices": count,
+                "storedVertices": kept[i],
+                "ratio": round(count / kept[i], 2),
+            },
+            "tags": tags,
+        }
+    return res
+
+
+def processed(geometry_format, precision, tolerance=1.0):
+    processor = LandmarkPreprocessor("", city="Cork")
+    processor.rawElements = copy.deepcopy(ELEMENTS)
+    return processor.findRawLandmarks().processRawLandmark(
+        tolerance=tolerance, precision=precision, geometry_format=geometry_format)
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("precision", [None, 5])
+@pytest.mark.parametrize("geometry_format", ["points", "pairs"])
+def test_saved_json_is_unchanged_byte_for_byte(workdir, geometry_format, precision):
+    processed(geometry_format, precision).saveAsFile("processed.json")
+    expected = reference_packages(ELEMENTS, 1.0, precision, geometry_format == "pairs")
+    assert (workdir / "outputfiles" / "processed.json").read_text(encoding="utf-8") == \
+        json.dumps(expected, indent=2, ensure_ascii=False)
+
+
+def test_simplified_vertices_are_dropped_from_the_shared_buffer():
+    processor = processed("points", None)
+    records = processor.processedLandmarks
+    assert records["Boole Library"].compression() == {"sourceVertices": 6, "storedVertices": 5, "ratio": 1.2}
+    assert len(processor.coordinates) == 2 * sum(record.count for record in records.values())
+    assert processor.rawLandmarks is None
+
+
+def test_records_keep_dict_access():
+    record = processed("points", None).processedLandmarks["Tŷ Coch"]
+    assert record["osmId"] == 2
+    assert record["bbox"] == record.bbox()
+    assert record["geometry"] == ELEMENTS[1]["geometry"]
+    assert record.get("tags") == {"historic": "building"}
+    assert record.get("riddle", "none") == "none"
+    with pytest.raises(KeyError):
+        record["riddle"]
+
+
+def test_document_shape():
+    processor = processed("points", None)
+    record = processor.processedLandmarks["Glucksman"]
+    polygon = processor.toDocument("Glucksman", record)
+    ring = polygon["geometry"]["coordinates"][0]
+    assert polygon["geometry"]["type"] == "Polygon" and ring[0] == ring[-1] and len(ring) == 4
+    assert polygon["centroid"] == {"latitude": record.latitude, "longitude": record.longitude}
+    line = processor.toDocument("Tŷ Coch", processor.processedLandmarks["Tŷ Coch"])
+    assert line["geometry"] == {"type": "LineString",
+                                "coordinates": [[pt["lon"], pt["lat"]] for pt in ELEMENTS[1]["geometry"]]}
+    assert line["city"] == "Cork" and line["riddle"] is None and line["osmVersion"] == 3
+
+
+@pytest.mark.parametrize("pairs", [False, True])
+def test_package_round_trip(pairs):
+    record = processed("points", None).processedLandmarks["Boole Library"]
+    package = record.toPackage(pairs)
+    assert LandmarkRecord.fromPackage(json.loads(json.dumps(package))).toPackage(pairs) == package
@@ -0,0 +1,70 @@
+import itertools
+
+import pytest
+
+from landmark_preprocessor import LandmarkPreprocessor
+from name_index import NameIndex, normalize_name
+
+
+def way(osm_id, name=None):
+    return {"type": "way", "id": osm_id, "tags": {"name": name} if name else {}, "geometry": []}
+
+
+ELEMENTS = [
+    way(1, "Boole Library"),
+    way(2, "BOOLE  LIBRARY"),
+    way(3, "The Quad / Aula Maxima"),
+    way(4, "Boole Library"),
+    way(5),
+]
+
+LANDMARK_LISTS = [
+    None,
+    ["Boole Library"],
+    ["boole library"],
+    ["Boole Library", "boole  library"],
+    ["the quad aula maxima", "Boole Library"],
+    ["Honan Chapel", "BOOLE LIBRARY"],
+]
+
+
+def picks(elements, landmarks, keep_duplicates, stream):
+    processor = LandmarkPreprocessor("")
+    if stream:
+        processor.rawStream = iter(elements)
+    else:
+        processor.rawElements = elements
+    processor.findRawLandmarks(landmarks, keep_duplicates=keep_duplicates)
+    return {key: entry["id"] for key, entry in dict(processor.rawLandmarks).items()}
+
+
+def test_normalize_name():
+    assert normalize_name("The Quad / Aula Maxima") == "thequadaulamaxima"
+    assert normalize_name("BOOLE  LIBRARY") == normalize_name("Boole Library")
+
+
+def test_find_prefers_exact_matches():
+    index = NameIndex(ELEMENTS)
+    assert [e["id"] for e in index.find("Boole Library")] == [1, 4]
+    assert [e["id"] for e in index.find("boole library")] == [1, 2, 4]
+    assert index.find("Honan Chapel") == []
+    assert len(index) == 3
+
+
+def test_normalized_map_is_built_on_first_normalized_lookup():
+    index = NameIndex(ELEMENTS[:2])
+    assert index._normalized is None
+    index.lookup("Boole Library")
+    assert index._normalized is None
+    index.lookupNormalized("boole library")
+    index.add(way(6, "boole-library"))
+    assert [e["id"] for e in index.lookupNormalized("Boole Library")] == [1, 2, 6]
+
+
+@pytest.mark.parametrize("keep_duplicates", [False, True])
+@pytest.mark.parametrize("landmarks", LANDMARK_LISTS)
+def test_streaming_matches_buffered_for_every_element_order(landmarks, keep_duplicates):
+    for order in itertools.permutations(ELEMENTS):
+        order = list(order)
+        expected = picks(order, landmarks, keep_duplicates, stream=False)
+        assert picks(order, landmarks, keep_duplicates, stream=True) == expected, [e["id"] for e in order]
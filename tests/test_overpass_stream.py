@@ -0,0 +1,81 @@
+import json
+import math
+
+import pytest
+
+import overpass_stream
+from overpass_stream import OverpassError, iter_elements
+
+ELEMENTS = [
+    {"type": "way", "id": 1, "tags": {"name": "Café ☕ \"Quay\" [1]", "note": "{not: json}"}},
+    {"type": "node", "id": 2, "lat": 51.897, "lon": -8.47, "tags": {}},
+    {"type": "relation", "id": 3, "members": [{"type": "way", "ref": 1, "role": "outer"}]},
+]
+BODY = json.dumps({
+    "version": 0.6,
+    "osm3s": {"copyright": "elements of the map"},
+    "elements": ELEMENTS,
+}, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_every_split_point():
+    # 包括切在多字节 UTF-8 字符、字符串转义和 "elements" 键中间的位置
+    for i in range(len(BODY) + 1):
+        assert list(iter_elements([BODY[:i], BODY[i:]])) == ELEMENTS, i
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 1 << 16])
+def test_fixed_size_chunks(size):
+    assert list(iter_elements(chunked(BODY, size))) == ELEMENTS
+
+
+def test_str_chunks():
+    assert list(iter_elements(chunked(BODY.decode("utf-8"), 5))) == ELEMENTS
+
+
+def test_empty_elements():
+    assert list(iter_elements([b'{"elements": [', b" ]}"])) == []
+
+
+def test_trailing_remark_raises_after_elements():
+    body = json.dumps({"elements": ELEMENTS[:1], "remark": "runtime error: Query timed out"}).encode()
+    parsed = []
+    with pytest.raises(OverpassError, match="timed out"):
+        for element in iter_elements(chunked(body, 3)):
+            parsed.append(element)
+    assert parsed == ELEMENTS[:1]
+
+
+def test_leading_remark_raises():
+    body = json.dumps({"remark": "runtime error: out of memory", "elements": []}).encode()
+    with pytest.raises(OverpassError, match="out of memory"):
+        list(iter_elements(chunked(body, 4)))
+
+
+def test_truncated_body_raises():
+    with pytest.raises(ValueError):
+        list(iter_elements([BODY[:len(BODY) // 2]]))
+
+
+def test_large_element_is_decoded_a_logarithmic_number_of_times(monkeypatch):
+    # 跨越很多 chunk 的元素: 每次解码失败后缓冲区至少翻倍, 重试次数约为 log2(chunk 数)
+    geometry = [{"lat": 51.0 + i * 1e-7, "lon": -8.0 - i * 1e-7} for i in range(20000)]
+    elements = [{"type": "way", "id": 1, "geometry": geometry}, {"type": "node", "id": 2}]
+    body = json.dumps({"elements": elements}).encode()
+    chunks = chunked(body, 1024)
+
+    calls = []
+
+    class CountingDecoder(json.JSONDecoder):
+        def raw_decode(self, s, idx=0):
+            calls.append(idx)
+            return super().raw_decode(s, idx)
+
+    monkeypatch.setattr(overpass_stream, "_decoder", CountingDecoder())
+    assert list(iter_elements(chunks)) == elements
+    assert len(chunks) > 500
+    assert len(calls) <= 2 * math.log2(len(chunks)) + 4
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from landmark_preprocessor import LandmarkPreprocessor
+
+PAYLOAD = json.dumps({
+    "version": 0.6,
+    "osm3s": {"copyright": "OpenStreetMap contributors"},
+    "elements": [
+        {"type": "way", "id": 1, "tags": {"name": "Boole Library", "amenity": "library"},
+         "geometry": [{"lat": 51.8930, "lon": -8.4920}, {"lat": 51.8930, "lon": -8.4910},
+                      {"lat": 51.8935, "lon": -8.4910}, {"lat": 51.8935, "lon": -8.4920}]},
+        {"type": "node", "id": 2, "tags": {"historic": "memorial"}},
+        {"type": "way", "id": 3, "tags": {"name": "Café Ólé \"Quad\""},
+         "geometry": [{"lat": 51.8941, "lon": -8.4923}, {"lat": 51.8942, "lon": -8.4911}]},
+        {"type": "way", "id": 4, "tags": {"name": "Glucksman", "tourism": "gallery"},
+         "geometry": [{"lat": 51.8951, "lon": -8.4961}, {"lat": 51.8954, "lon": -8.4955},
+                      {"lat": 51.8957, "lon": -8.4962}]},
+    ],
+}, ensure_ascii=False)
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def direct(landmarks=None, geometry_format="points"):
+    processor = LandmarkPreprocessor("", city="Cork")
+    processor.rawData = PAYLOAD
+    return processor.findRawLandmarks(landmarks).processRawLandmark(geometry_format=geometry_format)
+
+
+def packages(processor, pairs=False):
+    return {key: record.toPackage(pairs) for key, record in processor.processedLandmarks.items()}
+
+
+@pytest.mark.parametrize("landmarks", [None, ["Glucksman", "boole library"]])
+@pytest.mark.parametrize("filename", ["raw.json", "raw.json.gz", "raw.ndjson", "raw.ndjson.gz"])
+def test_raw_snapshot_replays_like_the_live_response(workdir, filename, landmarks):
+    saved = LandmarkPreprocessor("")
+    saved.rawData = PAYLOAD
+    saved.saveRawOSMAsFile(filename)
+
+    replayed = LandmarkPreprocessor.fromSnapshot(str(workdir / "outputfiles" / filename), city="Cork")
+    replayed.findRawLandmarks(landmarks).processRawLandmark()
+    assert packages(replayed) == packages(direct(landmarks))
+
+
+@pytest.mark.parametrize("geometry_format", ["points", "pairs"])
+@pytest.mark.parametrize("filename", ["processed.ndjson", "processed.ndjson.gz"])
+def test_processed_export_reloads_to_the_same_landmarks(workdir, filename, geometry_format):
+    original = direct(geometry_format=geometry_format).saveAsFile(filename)
+    pairs = geometry_format == "pairs"
+
+    reloaded = LandmarkPreprocessor.fromSnapshot(str(workdir / "outputfiles" / filename), city="Cork")
+    assert reloaded.geometryFormat == geometry_format
+    assert packages(reloaded, pairs) == packages(original, pairs)
+    for key, record in original.processedLandmarks.items():
+        assert reloaded.toDocument(key, reloaded.processedLandmarks[key]) == original.toDocument(key, record)
+
+    # 重新导出的 JSON 与原导出一致
+    original.saveAsFile("a.json")
+    reloaded.saveAsFile("b.json")
+    assert (workdir / "outputfiles" / "a.json").read_bytes() == (workdir / "outputfiles" / "b.json").read_bytes()
+
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import landmark_preprocessor
+from landmark_preprocessor import LandmarkPreprocessor
+from overpass_stream import OverpassError, iter_elements
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(landmark_preprocessor, "get_db", lambda name=None: db)
+    db.landmarks.insert_many(
+        [{"name": f"Area {i}", "city": "Cork", "source": "area", "osmType": "way", "osmId": i} for i in range(1, 6)]
+        + [
+            # 其他来源 / 其他城市 / 手工注入 (没有 osmId) 的地标不受影响
+            {"name": "Bbox 9", "city": "Cork", "source": "bbox", "osmType": "way", "osmId": 9},
+            {"name": "Galway 1", "city": "Galway", "source": "area", "osmType": "way", "osmId": 1},
+            {"name": "Injected", "city": "Cork", "source": "area", "osmType": None, "osmId": None},
+            {"name": "Area 7", "city": "Cork", "source": "area", "osmType": "way", "osmId": 7, "deleted": True},
+        ]
+    )
+    return db.landmarks
+
+
+def body(ids, remark=None):
+    payload = {"elements": [{"type": "way", "id": osm_id} for osm_id in ids]}
+    if remark:
+        payload["remark"] = remark
+    return json.dumps(payload)
+
+
+def refresh(ids, source="area", remark=None, stream=False):
+    processor = LandmarkPreprocessor("", city="Cork", source=source)
+    if stream:
+        data = body(ids, remark).encode()
+        processor.rawStream = iter_elements(data[i:i + 7] for i in range(0, len(data), 7))
+    else:
+        processor.rawData = body(ids, remark)
+    return processor
+
+
+def deleted_names(collection):
+    return sorted(doc["name"] for doc in collection.find({"deleted": True}))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_only_missing_landmarks_of_the_same_source_are_tombstoned(collection, stream):
+    assert refresh([1, 2, 3, 4], stream=stream).tombstoneMissing() == {"live": 4, "deleted": 1}
+    assert deleted_names(collection) == ["Area 5", "Area 7"]
+    assert collection.find_one({"name": "Area 5"})["deletedAt"] is not None
+    # Bbox 9 / Galway 1 / Injected 不在查询结果中, 但不属于这个查询
+    assert collection.count_documents({"deleted": {"$ne": True}}) == 7
+
+
+def test_other_source_is_scoped_separately(collection):
+    assert refresh([], source="bbox").tombstoneMissing(max_fraction=1) == {"live": 0, "deleted": 1}
+    assert deleted_names(collection) == ["Area 7", "Bbox 9"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_remark_raises_without_deleting(collection, stream):
+    processor = refresh([1, 2], remark="runtime error: Query timed out", stream=stream)
+    with pytest.raises(OverpassError, match="timed out"):
+        processor.tombstoneMissing()
+    assert deleted_names(collection) == ["Area 7"]
+
+
+def test_max_fraction_guard(collection):
+    with pytest.raises(RuntimeError, match="Refusing to tombstone 3/5"):
+        refresh([1, 2]).tombstoneMissing()
+    assert deleted_names(collection) == ["Area 7"]
+    assert refresh([1, 2]).tombstoneMissing(max_fraction=0.6)["deleted"] == 3
+
+
+def test_source_is_required(collection):
+    with pytest.raises(ValueError, match="source"):
+        refresh([1], source=None).tombstoneMissing()